@@ -0,0 +1,138 @@
+"""
+Traffic conditions in all hours of a year (8760 hours) for a section.
+
+Hourly volumes (one direction, as BasicSection.calculate_hourly_volume) are given by the user, e.g. from
+traffic counts, or calculated from ADT with a relative shape of the year given by the user (annual_volumes).
+All hours of a section are calculated at once with batch.evaluate_batch (hourly_volume column), with the same
+results as BasicSection for each hour.
+
+The method does not define a shape of the year. example_year_shape is an illustrative shape (made-up daily,
+weekly and seasonal factors) for trying the module out; it is not method data, so results calculated with it
+are not an assessment of a real section.
+"""
+import math
+from collections import Counter, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from backend import BasicSection
+from batch import COLUMNS, evaluate_batch
+
+HOURS_IN_YEAR = 8760
+
+# made-up factors of example_year_shape (not method data): relative volume in hours of the day (working days
+# and weekends), in days of the week (Monday first) and seasonal amplitude of profile (July peak)
+EXAMPLE_WORKDAY_HOUR_FACTORS = (0.20, 0.13, 0.10, 0.10, 0.18, 0.50, 1.20, 1.75, 1.70, 1.35, 1.25, 1.30,
+                                1.35, 1.40, 1.55, 1.80, 1.90, 1.75, 1.40, 1.05, 0.80, 0.60, 0.45, 0.30)
+EXAMPLE_WEEKEND_HOUR_FACTORS = (0.35, 0.25, 0.18, 0.15, 0.15, 0.25, 0.45, 0.70, 1.00, 1.35, 1.60, 1.75,
+                                1.75, 1.70, 1.65, 1.65, 1.65, 1.60, 1.45, 1.20, 0.95, 0.75, 0.55, 0.40)
+EXAMPLE_WEEKDAY_FACTORS = (0.97, 0.97, 0.98, 1.02, 1.12, 0.97, 0.90)
+EXAMPLE_SEASONAL_AMPLITUDE = {'DASM': 0.10, 'DASS': 0.25, 'DASD': 0.40, 'DGPG': 0.15}
+
+# inputs of evaluate_batch which are not needed when hourly volumes are given
+VOLUME_INPUTS = ('adt', 'profile')
+
+# summary of a year of one section
+AnnualSummary = namedtuple('AnnualSummary', ['hours', 'los_hours', 'hours_over_capacity', 'mean_speed',
+                                             'max_flow', 'max_utilization'])
+
+
+def example_year_shape(profile='DGPG', hours=HOURS_IN_YEAR):
+    """
+    Returns illustrative relative hourly volumes of a year starting on Monday, January 1st (mean 1).
+    The factors are made up and are not method data; use shapes from traffic counts for assessments.
+    """
+    hour = np.arange(hours)
+    day = hour // 24
+    weekday = day % 7
+    weekend = weekday >= 5
+    hour_factors = np.where(weekend,
+                            np.asarray(EXAMPLE_WEEKEND_HOUR_FACTORS)[hour % 24],
+                            np.asarray(EXAMPLE_WORKDAY_HOUR_FACTORS)[hour % 24])
+    season = 1 + EXAMPLE_SEASONAL_AMPLITUDE[profile] * np.cos(2 * np.pi * (day - 196) / 365)
+    shape = hour_factors * np.asarray(EXAMPLE_WEEKDAY_FACTORS)[weekday] * season
+    return shape / shape.mean()
+
+
+def annual_volumes(adt, shape):
+    """
+    Returns hourly volumes in one direction for ADT of the whole cross-section distributed with shape
+    (relative hourly volumes, e.g. from traffic counts); the mean of the day is ADT / 2.
+    """
+    shape = np.asarray(shape, dtype=float)
+    return np.trunc(adt / 2 / 24 * shape / shape.mean()).astype(np.int64)
+
+
+def profile_shape(shape, profile):
+    """
+    Returns shape of the year given as array, or as function of profile (e.g. example_year_shape).
+    """
+    if shape is None:
+        raise ValueError("Give hourly volumes or shape of the year (e.g. from traffic counts)")
+    return np.asarray(shape(profile) if callable(shape) else shape, dtype=float)
+
+
+def evaluate_hours(bs, hourly_volumes):
+    """
+    Calculates traffic metrics of section bs (BasicSection) for each of hourly volumes.
+    Returns dict of arrays: hourly_volume, k15, ew, flow, utilization, avg_speed and density
+    (NaN if capacity is exceeded) and los.
+    """
+    volumes = np.asarray(hourly_volumes, dtype=np.int64)
+    sections = {name: np.full(len(volumes), getattr(bs, name)) for name in COLUMNS if name not in VOLUME_INPUTS}
+    sections['hourly_volume'] = volumes
+    results = evaluate_batch(sections)
+    return {name: results[name] for name in ('hourly_volume', 'k15', 'ew', 'flow', 'utilization', 'avg_speed',
+                                             'density', 'los')}
+
+
+def summarize_hours(hours, los_labels):
+    """
+    Returns AnnualSummary of evaluate_hours results: hours in each LOS, hours with capacity exceeded,
+    mean speed of hours with uncongested traffic, the highest flow and utilization.
+    """
+    counts = Counter(hours['los'].tolist())
+    los_hours = {los: counts[los] for los in los_labels}
+    speeds = hours['avg_speed'][~np.isnan(hours['avg_speed'])]
+    return AnnualSummary(
+        hours=len(hours['flow']),
+        los_hours=los_hours,
+        hours_over_capacity=int(np.count_nonzero(hours['utilization'] > 1)),
+        mean_speed=round(float(speeds.mean()), 2) if len(speeds) else math.nan,
+        max_flow=int(hours['flow'].max()),
+        max_utilization=float(hours['utilization'].max()),
+    )
+
+
+def evaluate_year(road_class, access_points, speed_limit, area_type, adt, hv_share, profile, lanes, gradient=0,
+                  hourly_volumes=None, shape=None):
+    """
+    Evaluates all hours of a year of the section. Hourly volumes are given, or calculated from ADT
+    with shape of the year (array or function of profile, see annual_volumes); one of them is required.
+    Returns AnnualSummary.
+    """
+    bs = BasicSection(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type,
+                      adt=adt, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient)
+    if hourly_volumes is None:
+        hourly_volumes = annual_volumes(adt, profile_shape(shape, profile))
+    return summarize_hours(evaluate_hours(bs, hourly_volumes), bs.tables.los_labels)
+
+
+def evaluate_network(sections, shape):
+    """
+    Evaluates a year of each section of data frame with BasicSection columns (as in run_batch.py), with
+    shape of the year (array or function of profile, calculated once per profile).
+    Returns data frame with hours in each LOS (columns hours_A ... hours_F), hours_over_capacity,
+    mean_speed, max_flow and max_utilization, in the order of sections.
+    """
+    columns = [column for column in COLUMNS if column in sections.columns]
+    shapes = {profile: profile_shape(shape, profile) for profile in sections['profile'].unique()}
+    rows = []
+    for section in sections[columns].itertuples(index=False):
+        summary = evaluate_year(**section._asdict(), shape=shapes[section.profile])
+        row = {f"hours_{los}": hours for los, hours in summary.los_hours.items()}
+        row.update(hours_over_capacity=summary.hours_over_capacity, mean_speed=summary.mean_speed,
+                   max_flow=summary.max_flow, max_utilization=summary.max_utilization)
+        rows.append(row)
+    return pd.DataFrame(rows, index=sections.index)
@@ -0,0 +1,271 @@
+"""
+Local HTTP JSON API for traffic conditions assessment (standard library only).
+
+Example:
+    python api_server.py --port 8000 --workers 4
+
+Endpoints:
+    POST /section   one section, body: BasicSection inputs, e.g. {"road_class": "S", "access_points": 0.5, ...};
+                    returns all metrics (BasicSection.evaluate) and critical flows of LOS A-E (LOS F has no upper
+                    density boundary)
+    POST /batch     many sections, body: {"sections": [{...}, ...]} or columns {"road_class": [...], ...};
+                    calculated with compiled tables (or the vectorized engine, if they are missing or out of date)
+                    in a worker process, returns columns of results
+    GET  /curve     Van Aerde curve, query: road_class, ffs and optionally points (0 - full curve up to LOS E)
+    GET  /health    status
+    GET  /metrics   number of requests, errors and latency of endpoints, curve cache statistics
+
+Tables, compiled tables and Van Aerde curves are loaded once in the server process and in each worker process
+and shared by all requests. Batches run in a process pool: the body is decoded, calculated and encoded into the JSON response
+in a worker process, so the event loop is not blocked by calculations nor by (de)serialization of large bodies.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+from backend import BasicSection
+from batch import COLUMNS
+from compiled_tables import evaluate_compiled_or_batch, get_compiled
+from run_batch import RESULT_COLUMNS
+from table_registry import get_tables
+from van_aerde import curve_cache, plot_points
+
+MAX_BODY = 64 * 1024 * 1024
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+          500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # raised in worker processes and passed to the server process
+        return HttpError, (self.status, str(self))
+
+
+def _init_worker():
+    # tables, compiled tables and curves loaded once per worker process
+    get_tables()
+    get_compiled()
+    curve_cache.prewarm()
+
+
+def _jsonable(values):
+    # NaN (congested traffic) is returned as null
+    return [None if isinstance(value, float) and math.isnan(value) else value for value in values.tolist()]
+
+
+def evaluate_section(inputs):
+    """
+    Returns dict with all metrics of one section and critical flows {LOS: [speed, flow]} of LOS with upper
+    density boundary (the last LOS is unbounded).
+    """
+    try:
+        bs = BasicSection(**inputs)
+        result = bs.evaluate()._asdict()
+        critical_flows = list(bs.calculate_critical_flows().items())[:-1]
+        result['critical_flows'] = {los: list(values) for los, values in critical_flows}
+    except (TypeError, KeyError, ValueError) as error:
+        raise HttpError(400, f"Invalid section: {error}")
+    return {name: None if isinstance(value, float) and math.isnan(value) else value for name, value in result.items()}
+
+
+def evaluate_sections(sections):
+    """
+    Calculates sections given as columns (dict of lists) with compiled tables (or the vectorized engine).
+    Returns dict of result lists.
+    """
+    results = evaluate_compiled_or_batch({name: np.asarray(sections[name]) for name in COLUMNS if name in sections})
+    return {column: _jsonable(np.asarray(results[column])) for column in RESULT_COLUMNS}
+
+
+def _json_body(data):
+    try:
+        return json.loads(data) if data else {}
+    except ValueError:
+        raise HttpError(400, "Body is not valid JSON")
+
+
+def batch_response(data):
+    """
+    Decodes batch request body (JSON bytes), calculates sections and returns the response encoded as JSON bytes.
+    Runs in a worker process.
+    """
+    sections = _columns(_json_body(data))
+    try:
+        results = evaluate_sections(sections)
+    except (TypeError, KeyError, ValueError) as error:
+        raise HttpError(400, f"Invalid sections: {error}")
+    return json.dumps({'count': len(results['los']), 'results': results}).encode()
+
+
+def _columns(body):
+    # batch body: list of sections or dict of columns
+    sections = body.get('sections', body) if isinstance(body, dict) else body
+    if isinstance(sections, list):
+        if not sections:
+            raise HttpError(400, "No sections")
+        try:
+            return {name: [section[name] for section in sections] for name in COLUMNS if name in sections[0]}
+        except (KeyError, TypeError) as error:
+            raise HttpError(400, f"Invalid sections: missing {error}")
+    if isinstance(sections, dict):
+        return sections
+    raise HttpError(400, "Sections should be a list of objects or an object of columns")
+
+
+class Metrics:
+    """
+    Number of requests, errors and latencies (last 1000 requests) of each endpoint.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.requests = {}
+        self.errors = {}
+        self.latencies = {}
+
+    def add(self, endpoint, elapsed, error=False):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        if error:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        self.latencies.setdefault(endpoint, deque(maxlen=1000)).append(elapsed)
+
+    def to_dict(self):
+        latency = {}
+        for endpoint, values in self.latencies.items():
+            values = np.array(values) * 1000
+            latency[endpoint] = {'p50_ms': round(float(np.percentile(values, 50)), 3),
+                                 'p99_ms': round(float(np.percentile(values, 99)), 3)}
+        return {'uptime_s': round(time.time() - self.started, 1),
+                'requests': self.requests,
+                'errors': self.errors,
+                'latency': latency,
+                'curve_cache': curve_cache.stats()}
+
+
+class ApiServer:
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.pool = None
+        self.metrics = Metrics()
+        self.routes = {
+            ('POST', '/section'): self.section,
+            ('POST', '/batch'): self.batch,
+            ('GET', '/curve'): self.curve,
+            ('GET', '/health'): self.health,
+            ('GET', '/metrics'): self.get_metrics,
+        }
+
+    async def section(self, query, data):
+        return evaluate_section(_json_body(data))
+
+    async def batch(self, query, data):
+        # JSON response already encoded by the worker
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, batch_response, data)
+
+    async def curve(self, query, data):
+        try:
+            road_class = query['road_class'][0]
+            ffs = int(query['ffs'][0])
+            points = int(query.get('points', ['300'])[0])
+            curve = curve_cache.get(road_class, ffs)
+        except (KeyError, ValueError):
+            raise HttpError(400, "Query needs road_class and ffs of the capacity table (and optionally points)")
+        if points > 0:
+            volume, speed = plot_points(curve, points)
+        else:
+            volume, speed = curve.uncongested_volume, curve.uncongested_speed
+        return {'road_class': road_class, 'ffs': ffs, 'volume': volume.tolist(), 'speed': speed.tolist()}
+
+    async def health(self, query, data):
+        return {'status': 'ok', 'workers': self.workers, 'curves': curve_cache.stats()['size'],
+                'compiled_tables': get_compiled() is not None}
+
+    async def get_metrics(self, query, data):
+        return self.metrics.to_dict()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+
+                start = time.perf_counter()
+                url = urlsplit(target)
+                status, response = 200, None
+                try:
+                    if length > MAX_BODY:
+                        raise HttpError(413, "Request body too large")
+                    data = await reader.readexactly(length) if length else b''
+                    route = self.routes.get((method, url.path))
+                    if route is None:
+                        paths = [path for _, path in self.routes]
+                        raise HttpError(405 if url.path in paths else 404, f"No endpoint {method} {url.path}")
+                    response = await route(parse_qs(url.query), data)
+                except HttpError as error:
+                    status, response = error.status, {'error': str(error)}
+                except Exception as error:
+                    status, response = 500, {'error': repr(error)}
+                endpoint = url.path if status not in (404, 405) else 'unknown'
+                self.metrics.add(endpoint, time.perf_counter() - start, error=status != 200)
+
+                payload = response if isinstance(response, bytes) else json.dumps(response).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                writer.write(f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+                await writer.drain()
+                if not keep_alive or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8000):
+        _init_worker()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP JSON API for traffic conditions assessment.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=2, help="number of worker processes for batches")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(ApiServer(workers=args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
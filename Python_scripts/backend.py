@@ -1,14 +1,76 @@
-import pandas as pd
 import numpy as np
 import math
-from pathlib import Path
+import functools
+import os
+from collections import namedtuple
+
+from table_registry import get_tables
+from van_aerde import VanAerdeModel, OPT_DENSITY, PLOT_POINTS, curve_cache, plot_points
+
+# free-flow speed model: intercept and range of ffs for road class (other road classes are calculated as GPG)
+FFS_INTERCEPT = {'A': 82.2, 'S': 83.5, 'GPG': 80.5}
+FFS_RANGE = {'A': (90, 130), 'S': (90, 120), 'GPG': (80, 110)}
+
+# k15 = a + b * ln(volume / lanes) for area type, if hourly volume is at least K15_MIN_VOLUME
+K15_COEFFICIENTS = {0: (0.482, 0.063), 1: (0.725, 0.029)}
+K15_MIN_VOLUME = 1000
+K15_LOW_VOLUME = 0.87
+
+# upper bounds of gradient categories in conversion factors table
+GRADIENT_CATEGORIES = (0.02, 0.03, 0.04, 0.05)
+# estimated utilization rate from which conversion factors for max_util_rate 1 are used
+EW_UTIL_THRESHOLD = 0.75
+
+# all metrics of one section, see BasicSection.evaluate (namedtuple: immutable, no per-instance __dict__)
+SectionResult = namedtuple('SectionResult', [
+    'ffs', 'u50', 'hourly_volume', 'k15', 'ew', 'flow', 'base_capacity', 'real_capacity', 'utilization',
+    'opt_speed', 'jam_density', 'congested', 'avg_speed', 'density', 'los'])
+
+
+def memoized(method):
+    """
+    Stores method result in the section cache. The cache is cleared when any of section inputs is reassigned.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items()))) if kwargs else (method.__name__, args)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        # calculated outside the except block, so errors of the method are not chained to the cache miss
+        result = method(self, *args, **kwargs)
+        self._cache[key] = result
+        return result
+    return wrapper
+
+
+def classify_los(density, tables=None):
+    """
+    Assesses the level of service for lane density (scalar or array) with one search in LOS boundaries.
+    Density of congested traffic (None or NaN) and density above the last boundary give the last LOS (F).
+    Returns LOS name or array of names.
+    """
+    tables = tables or get_tables()
+    values = np.asarray(np.nan if density is None else density, dtype=float)
+    i = np.searchsorted(tables.los_bounds, values, side='left')
+    i = np.where(np.isnan(values) | (i >= len(tables.los_labels)), len(tables.los_labels) - 1, i)
+    if values.ndim == 0:
+        return tables.los_labels[int(i)]
+    return np.array(tables.los_labels, dtype=object)[i]
+
 
 class BasicSection:
     """
     Class of functions to calculate traffic metrics at basic section of dual-carriageway uninterrupted traffic facility
     """
+    # attributes given by the user, reassigning any of them invalidates calculated values
+    INPUTS = ('road_class', 'access_points', 'speed_limit', 'area_type', 'adt', 'hv_share',
+              'profile', 'lanes', 'gradient')
+
     def __init__(self, road_class, access_points, speed_limit, area_type, adt, hv_share, 
-                 profile, lanes, gradient=0):
+                 profile, lanes, gradient=0, solver='grid'):
+        self._cache = {}
         self.road_class = road_class
         self.access_points = access_points      # means the density of access points (number of access points per 10 kms)
         self.speed_limit = speed_limit
@@ -18,59 +80,49 @@ class BasicSection:
         self.profile = profile
         self.lanes = lanes
         self.gradient = gradient
+        self.solver = solver                    # 'grid' - search in van_aerde_calculations df, 'analytic' - closed-form solution of Van Aerde model
+
+        # shared tables, parsed from csv files once per process (read-only)
+        self.tables = get_tables()
+
+    # data frames of the tables, read (with pandas) only when accessed
+    u50_table = property(lambda self: self.tables.u50_table)
+    ew_table = property(lambda self: self.tables.ew_table)
+    los_table = property(lambda self: self.tables.los_table)
+    capacity_table = property(lambda self: self.tables.capacity_table)
 
-        # load dfs from csv files
-        self.u50_table = pd.read_csv(Path(__file__).parent / 'data_tables' / 'u50.csv')
-        self.ew_table = pd.read_csv(Path(__file__).parent / 'data_tables' / 'ew_rate.csv')
-        self.los_table = pd.read_csv(Path(__file__).parent / 'data_tables' / 'psr_bound.csv')
-        self.capacity_table = pd.read_csv(Path(__file__).parent / 'data_tables' / 'capacity.csv')
+    def __setattr__(self, name, value):
+        if name in self.INPUTS or name == 'solver':
+            self._cache.clear()
+        object.__setattr__(self, name, value)
     
+    @memoized
     def calculate_ffs(self):
         """
         Calculates free-flow speed, which is a speed of light vehicles in conditions of low traffic volumes.
         """
+        road_class = self.road_class if self.road_class in FFS_INTERCEPT else 'GPG'
 
-        if self.road_class == 'A':
-            ffs = round(82.2 
-            - 10.7 * self.access_points
-            + 7.7 * self.area_type
-            + 0.334 * self.speed_limit)
-        elif self.road_class == 'S':
-            ffs = round(83.5 
-            - 10.7 * self.access_points
-            + 7.7 * self.area_type
-            + 0.334 * self.speed_limit)
-        else:
-            ffs = round(80.5 
+        ffs = round(FFS_INTERCEPT[road_class]
             - 10.7 * self.access_points
             + 7.7 * self.area_type
             + 0.334 * self.speed_limit)
-        
 
         # if ffs out-of-range apply the closest value in the range
-        if self.road_class == 'A':
-            if ffs > 130:
-                ffs = 130
-            elif ffs < 90:
-                ffs = 90
-        elif self.road_class == 'S':
-            if ffs > 120:
-                ffs = 120
-            elif ffs < 90:
-                ffs = 90
-        else:
-            if ffs > 110:
-                ffs = 110
-            elif ffs < 80:
-                ffs = 80
+        min_ffs, max_ffs = FFS_RANGE[road_class]
+        if ffs > max_ffs:
+            ffs = max_ffs
+        elif ffs < min_ffs:
+            ffs = min_ffs
 
         return ffs
     
+    @memoized
     def define_u50(self):
-        u50_row = self.u50_table[(self.u50_table['Profile'] == self.profile) & (self.u50_table['ADT_min'] <= self.adt) & (self.u50_table['ADT_max'] >= self.adt)]
-        u50 = float(u50_row.iloc[0]['u50'])
+        u50 = self.tables.lookup_u50(self.profile, self.adt)
         return u50
     
+    @memoized
     def calculate_hourly_volume(self):
         """
         Calculates hourly traffic volume (in one direction) from annual average daily traffic (ADT) based on u50 factor.
@@ -85,44 +137,40 @@ class BasicSection:
         
         return calculated_adt
 
+    @memoized
     def calculate_k15(self):
         """
         Calculates k15 factor, based on hourly traffic volume.
         """
-        if self.calculate_hourly_volume() >= 1000:
-            if self.area_type == 0:
-                k15 = 0.482 + 0.063 * math.log(self.calculate_hourly_volume() / self.lanes)
-            elif self.area_type == 1:
-                k15 = 0.725 + 0.029 * math.log(self.calculate_hourly_volume() / self.lanes)
+        if self.calculate_hourly_volume() >= K15_MIN_VOLUME:
+            a, b = K15_COEFFICIENTS[self.area_type]
+            k15 = a + b * math.log(self.calculate_hourly_volume() / self.lanes)
         else:
-            k15 = 0.87
+            k15 = K15_LOW_VOLUME
         
         return round(k15, 2)
 
+    @memoized
     def estimate_base_capacity(self):
         """
         Calculates base capacity based on free flow speed (ffs). If ffs out-of-range for the method, lower or upper boundary is adopted.
         """
         ffs = self.calculate_ffs()
-        df = self.capacity_table
-        cap_row = df[(df['ffs'] == ffs) & (df['road_class'] == self.road_class)]
-        base_capacity = int(cap_row.iloc[0]['base_capacity'])
+        base_capacity = self.tables.lookup_capacity(self.road_class, ffs).base_capacity
         
         return base_capacity
 
+    @memoized
     def calculate_ew(self, est_util_rate=0.75):
         """
         Calculates conversion factor for heavy vehicles share and vertical alignment.
         """
         # set gradient category
-        if self.gradient <= 0.02:
-            max_gradient = 0.02
-        elif self.gradient <= 0.03:
-            max_gradient = 0.03
-        elif self.gradient <= 0.04:
-            max_gradient = 0.04
-        else:
-            max_gradient = 0.05
+        max_gradient = GRADIENT_CATEGORIES[-1]
+        for category in GRADIENT_CATEGORIES:
+            if self.gradient <= category:
+                max_gradient = category
+                break
         
         # choose conversion factor if lanes==4 (not covered in method)
                 ### TO BE DECIDED!!!
@@ -132,39 +180,52 @@ class BasicSection:
             no_of_lanes = self.lanes
 
         # calculate light vehicles conversion factor
-        Es_row = self.ew_table[(self.ew_table['veh_type'] == 'lv') 
-                               & (self.ew_table['max_gradient'] == max_gradient)]
-        Es = float(Es_row.iloc[0]['conv_factor'])
+        Es = self.tables.lookup_es(max_gradient)
         
         # calculate heavy vehicles conversion factor
-        Ec_row = self.ew_table[(self.ew_table['veh_type'] == 'hv') 
-                               & (self.ew_table['road_class'] == self.road_class) 
-                               & (self.ew_table['lanes'] == no_of_lanes)
-                               & (self.ew_table['max_util_rate'] == est_util_rate)
-                               & (self.ew_table['max_gradient'] == max_gradient)]
-        Ec = float(Ec_row.iloc[0]['conv_factor'])
+        Ec = self.tables.lookup_ec(self.road_class, no_of_lanes, est_util_rate, max_gradient)
 
         # calculate weighted conversion factor
         Ew = round(Es * (1 - self.hv_share) + Ec * self.hv_share, 2)
 
         return Ew
 
-    def calculate_flow(self):
+    @memoized
+    def select_ew(self):
         """
-        Calculates traffic flow at the section (expressed in light vehicles per hour per 1 lane)
+        Returns conversion factor used to calculate flow: for max utilization rate 0.75, 
+        or for max utilization rate 1 if flow calculated with the first one reaches 0.75 of base capacity.
         """
         flow = round(self.calculate_hourly_volume()
                      * self.calculate_ew()
                      / (self.lanes * self.calculate_k15()))
         
         # checking the condition for max utilization rate in conversion factors (Ew) table
-        if flow / self.estimate_base_capacity() >= 0.75:
-            flow = round(self.calculate_hourly_volume()
-                     * self.calculate_ew(est_util_rate=1)
+        if flow / self.estimate_base_capacity() >= EW_UTIL_THRESHOLD:
+            return self.calculate_ew(est_util_rate=1)
+
+        return self.calculate_ew()
+
+    @memoized
+    def calculate_flow(self):
+        """
+        Calculates traffic flow at the section (expressed in light vehicles per hour per 1 lane)
+        """
+        flow = round(self.calculate_hourly_volume()
+                     * self.select_ew()
                      / (self.lanes * self.calculate_k15()))
 
         return flow
 
+    @memoized
+    def calculate_real_capacity(self):
+        """
+        Calculates capacity of the section in vehicles per hour (all lanes), with conversion factor for max utilization rate 0.75.
+        """
+        real_capacity = round(self.estimate_base_capacity() * self.lanes * self.calculate_k15() / self.calculate_ew())
+        return real_capacity
+
+    @memoized
     def calculate_utilization(self):
         """
         Calculates utilization rate as a 'flow' to 'base capacity' rate
@@ -172,119 +233,213 @@ class BasicSection:
         util_rate = round(self.calculate_flow() / self.estimate_base_capacity(), 2)
         return util_rate
 
+    @memoized
     def calculate_opt_speed(self):
 
         ffs = self.calculate_ffs()
-        df = self.capacity_table
-        opt_speed_row = df[(df['ffs'] == ffs) & (df['road_class'] == self.road_class)]
-        opt_speed = float(opt_speed_row.iloc[0]['opt_speed'])
+        opt_speed = self.tables.lookup_capacity(self.road_class, ffs).opt_speed
         
         return opt_speed
     
+    @memoized
     def calculate_jam_density(self):
 
         ffs = self.calculate_ffs()
-        df = self.capacity_table
-        jam_density_row = df[(df['ffs'] == ffs) & (df['road_class'] == self.road_class)]
-        jam_density = float(jam_density_row.iloc[0]['jam_density'])
+        jam_density = self.tables.lookup_capacity(self.road_class, ffs).jam_density
         
         return jam_density
 
+    @memoized
+    def van_aerde_model(self):
+        """
+        Returns Van Aerde model of the section with parameters adopted from capacity table.
+        """
+        return VanAerdeModel(capacity=self.estimate_base_capacity(),
+                             opt_speed=self.calculate_opt_speed(),
+                             ffs=self.calculate_ffs(),
+                             jam_density=self.calculate_jam_density())
+
+    @memoized
+    def van_aerde_curve(self):
+        """
+        Returns Van Aerde model calculations with speed step 0.01 as arrays, shared by all sections 
+        with the same road class and free flow speed (see van_aerde.curve_cache).
+        """
+        return curve_cache.get(self.road_class, self.calculate_ffs())
+
+    def van_aerde_plot_curve(self, points=PLOT_POINTS):
+        """
+        Returns (volume, speed) arrays of the curve up to LOS E boundary downsampled to the given number of points
+        (shape-preserving LTTB), for charts.
+        """
+        return plot_points(self.van_aerde_curve(), points)
+
     def van_aerde_calculations(self):
         """
         Returns data frame with Van Aerde model calculations with speed step 0.01.
         Model parameters are adopted from capacity table and above calculations. 
         Jam density is an empirical value adopted based on own research.
         """
-        # model parameters
-        capacity = self.estimate_base_capacity()
-        opt_speed = self.calculate_opt_speed()
-        ffs = self.calculate_ffs()
-        jam_density = self.calculate_jam_density()        
+        import pandas as pd
 
-        # Van Aerde model coefficients
-        m = (2* opt_speed - ffs) / ((ffs - opt_speed)**2)
-        c2 = 1 / (jam_density * (m + 1/ffs))
-        c1 = m * c2
-        c3 = (1/opt_speed) * ((opt_speed/capacity) - c1 - c2/(ffs - opt_speed))
-
-        # create df for model calculations with first column with speed decreasing by 1 in each row
-        data = {'speed': [round(float(speed),2) for speed in np.arange(ffs, -0.01, -0.01)]}
-        df = pd.DataFrame(data)
-        df['density'] = round(1 / (c1 + c2/(ffs - df['speed']) + c3 * df['speed']), 2)
-        df['volume'] = round(df['speed'] * df['density'], 2)
+        curve = self.van_aerde_curve()
+        df = pd.DataFrame({'speed': curve.speed, 'density': curve.density, 'volume': curve.volume})
 
         return df
 
+    @memoized
     def calculate_avg_speed(self):
         """
         Calculates average speed at the flow if capacity is not exceeded.
         
         """
         # calculated only for uninterrupted flow
-        opt_density = 26.5
+        opt_density = OPT_DENSITY
 
-        df_all_densitites = self.van_aerde_calculations()
-        df = df_all_densitites[df_all_densitites['density'] <= opt_density]
+        if self.solver == 'analytic':
+            if self.calculate_utilization() <= 1:
+                return round(self.van_aerde_model().speed_at_flow(self.calculate_flow(), max_density=opt_density), 2)
+            return None
 
-        # find the closest volume to flow in df['volume'] 
-        # method 1 from https://www.geeksforgeeks.org/finding-the-nearest-number-in-a-dataframe-using-pandas/  
+        # find the closest volume to flow in the curve up to opt_density
         if self.calculate_utilization() <= 1:
-            flow = self.calculate_flow()
-            differences = np.abs(df['volume'] - flow)
-            nearest_index = differences.argsort()[0]
-            nearest_volume = float(df['volume'].iloc[nearest_index])
-            nearest_volume_row = df[df['volume'] == nearest_volume]
-            avg_speed = float(nearest_volume_row.iloc[0]['speed'])
+            avg_speed = self.van_aerde_curve().speed_at_flow(self.calculate_flow())
             return avg_speed
         else:           #### exception when LOS F!!!!!!!!!!!!!!!
             return None
 
+    @memoized
     def calculate_density(self):
         """
-        Calculates density based on fundamental relationship of traffic flow (flow to avg speed) 
+        Calculates density based on fundamental relationship of traffic flow (flow to avg speed).
+        Density cannot be calculated for congested traffic regime, then None is returned.
         """
-        try:
-            density = round(self.calculate_flow() / self.calculate_avg_speed(), 1)
-            return density
-        except Exception:
-            print("Density cannot be calculated for congested traffic regime.")
+        avg_speed = self.calculate_avg_speed()
+        if avg_speed is None:
+            return None
+        density = round(self.calculate_flow() / avg_speed, 1)
+        return density
 
+    @memoized
     def assess_los(self):
         """
         Assesses the level of service based on density and boundaries defined in los_table
         """
-        df = self.los_table
-        density = self.calculate_density()
-        df['lane_density'] = pd.to_numeric(df['lane_density'])
-        try:
-            for index, row in df.iterrows():
-                if density <= row['lane_density']:
-                    return row['LOS']
-        except:
-            return "F"
+        return classify_los(self.calculate_density(), self.tables)
+
+    @memoized
+    def evaluate(self):
+        """
+        Calculates all metrics of the section in dependency order, each of them once.
+        Returns SectionResult; for congested traffic (capacity exceeded) congested is True
+        and avg_speed and density are NaN.
+        """
+        avg_speed = self.calculate_avg_speed()
+        congested = avg_speed is None
+        return SectionResult(
+            ffs=self.calculate_ffs(),
+            u50=self.define_u50(),
+            hourly_volume=self.calculate_hourly_volume(),
+            k15=self.calculate_k15(),
+            ew=self.select_ew(),
+            flow=self.calculate_flow(),
+            base_capacity=self.estimate_base_capacity(),
+            real_capacity=self.calculate_real_capacity(),
+            utilization=self.calculate_utilization(),
+            opt_speed=self.calculate_opt_speed(),
+            jam_density=self.calculate_jam_density(),
+            congested=congested,
+            avg_speed=math.nan if congested else avg_speed,
+            density=math.nan if congested else self.calculate_density(),
+            los=self.assess_los(),
+        )
 
     def extract_los_density(self):
         """
         Returns LOS critical density
         """
-        df = self.los_table
-        density = float(df[df['LOS'] == self.assess_los()]['lane_density'])
+        density = self.tables.lookup_los_density(self.assess_los())
         return density
 
+    @memoized
+    def calculate_critical_flows(self):
+        """
+        Calculates speed and flow at lane densities of all LOS boundaries from los_table in one evaluation of the curve.
+        Returns dict {LOS: (speed, flow)}.
+        """
+        los = self.tables.los_labels
+        densities = self.tables.los_bounds
+
+        if self.solver == 'analytic':
+            speeds, flows = zip(*(self.calculate_metrics_at_density(density) for density in densities))
+        else:
+            speeds, flows = self.van_aerde_curve().metrics_at_densities(densities)
+
+        return {name: (float(speed), float(flow)) for name, speed, flow in zip(los, speeds, flows)}
+
+    @memoized
     def calculate_metrics_at_density(self, density):
         """
         Calculates speed and flow at given density
         :param: density(float): lane density expressed in pc/km/lane
         """
-        df = self.van_aerde_calculations()
-        differences = np.abs(df['density'] - density)
-        nearest_index = differences.argsort()[0]
-        nearest_density = float(df['density'].iloc[nearest_index])
-        nearest_density_row = df[df['density'] == nearest_density]
-        speed = float(nearest_density_row.iloc[0]['speed'])
-        flow = float(nearest_density_row.iloc[0]['volume'])
+        if self.solver == 'analytic':
+            speed = self.van_aerde_model().speed_at_density(density)
+            return round(speed, 2), round(speed * density, 2)
+
+        speed, flow = self.van_aerde_curve().metrics_at_density(density)
         return speed, flow
-    
 
 
+# results shown on the assessment page for one set of inputs
+SectionAssessment = namedtuple('SectionAssessment', [
+    'hourly_volume', 'ffs', 'flow', 'base_capacity', 'real_capacity', 'opt_speed', 'jam_density',
+    'avg_speed', 'density', 'los', 'curve_volume', 'curve_speed', 'critical_flows'])
+
+
+def assess_section(road_class, access_points, speed_limit, area_type, adt, hv_share, profile, lanes,
+                   gradient=0, input_hourly_volume=None, plot_points=PLOT_POINTS):
+    """
+    Calculates all results of the assessment page (metrics, speed-flow curve up to LOS E, critical flows and LOS).
+    If input_hourly_volume is given, ADT is calculated from it and u50 factor.
+    The curve is downsampled to plot_points points (see BasicSection.van_aerde_plot_curve).
+    Returns SectionAssessment with immutable values (curve as tuples, critical flows as (LOS, speed, flow) tuples).
+    """
+    bs = BasicSection(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type,
+                      adt=adt, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient)
+
+    if input_hourly_volume is not None:
+        bs.adt = bs.calculate_adt_from_volume(input_hourly_volume)
+        hourly_volume = input_hourly_volume
+    else:
+        hourly_volume = bs.calculate_hourly_volume()
+
+    return build_assessment(bs, hourly_volume, plot_points)
+
+
+def build_assessment(bs, hourly_volume, plot_points=PLOT_POINTS):
+    """
+    Returns SectionAssessment of BasicSection bs (values already calculated in bs are reused).
+    """
+    curve_volume, curve_speed = bs.van_aerde_plot_curve(plot_points)
+
+    return SectionAssessment(
+        hourly_volume=hourly_volume,
+        ffs=bs.calculate_ffs(),
+        flow=bs.calculate_flow(),
+        base_capacity=bs.estimate_base_capacity(),
+        real_capacity=bs.calculate_real_capacity(),
+        opt_speed=bs.calculate_opt_speed(),
+        jam_density=bs.calculate_jam_density(),
+        avg_speed=bs.calculate_avg_speed(),
+        density=bs.calculate_density(),
+        los=bs.assess_los(),
+        curve_volume=tuple(curve_volume.tolist()),
+        curve_speed=tuple(curve_speed.tolist()),
+        critical_flows=tuple((los, speed, flow) for los, (speed, flow) in bs.calculate_critical_flows().items()),
+    )
+
+
+# opt-in instrumentation for the whole process (see instrumentation.py)
+if os.environ.get('TRAFFIC_INSTRUMENTATION'):
+    import instrumentation
@@ -0,0 +1,226 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from backend import (classify_los, FFS_INTERCEPT, FFS_RANGE, K15_COEFFICIENTS, K15_MIN_VOLUME, K15_LOW_VOLUME,
+                     GRADIENT_CATEGORIES, EW_UTIL_THRESHOLD)
+from table_registry import get_tables
+from van_aerde import curve_cache
+
+# input columns, the same as BasicSection arguments
+COLUMNS = ('road_class', 'access_points', 'speed_limit', 'area_type', 'adt', 'hv_share', 'profile', 'lanes', 'gradient')
+
+ROAD_CLASSES = tuple(FFS_INTERCEPT)
+UTIL_RATES = (EW_UTIL_THRESHOLD, 1.0)
+
+
+def python_round(values, ndigits):
+    """
+    Rounds array values the same way as built-in round().
+    np.round scales values by 10**ndigits, so for values close to half of the last digit
+    it can round differently; such values are rounded with round().
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, ndigits)
+    scaled = values * 10**ndigits
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_half.any():
+        rounded[near_half] = [round(value, ndigits) for value in values[near_half].tolist()]
+    return rounded
+
+
+@lru_cache(maxsize=4)
+def _compiled_arrays(tables):
+    """
+    Dense arrays of capacity table and conversion factors for vectorized lookups.
+    """
+    ffs_min = np.array([FFS_RANGE[road_class][0] for road_class in ROAD_CLASSES])
+    ffs_count = max(FFS_RANGE[road_class][1] - FFS_RANGE[road_class][0] + 1 for road_class in ROAD_CLASSES)
+
+    # [road_class, ffs - ffs_min]
+    base_capacity = np.zeros((len(ROAD_CLASSES), ffs_count), dtype=np.int64)
+    for road_class, ffs in tables.capacity_keys():
+        if road_class in ROAD_CLASSES:
+            i = ROAD_CLASSES.index(road_class)
+            base_capacity[i, ffs - ffs_min[i]] = tables.lookup_capacity(road_class, ffs).base_capacity
+
+    # Es: [gradient], Ec: [road_class, lanes (2 or 3), util rate, gradient]
+    es = np.array([tables.lookup_es(gradient) for gradient in GRADIENT_CATEGORIES])
+    ec = np.full((len(ROAD_CLASSES), 2, len(UTIL_RATES), len(GRADIENT_CATEGORIES)), np.nan)
+    for i, road_class in enumerate(ROAD_CLASSES):
+        for j, lanes in enumerate((2, 3)):
+            for k, util_rate in enumerate(UTIL_RATES):
+                for m, gradient in enumerate(GRADIENT_CATEGORIES):
+                    try:
+                        ec[i, j, k, m] = tables.lookup_ec(road_class, lanes, util_rate, gradient)
+                    except KeyError:
+                        pass
+    return ffs_min, base_capacity, es, ec
+
+
+def _column(sections, name, size=None):
+    if name == 'gradient' and name not in sections:
+        return np.zeros(size)
+    return np.asarray(sections[name])
+
+
+def _check_found(found, message):
+    if not found.all():
+        raise KeyError(f"{message} for rows {np.flatnonzero(~found)[:10].tolist()}")
+
+
+def calculate_ffs(road_class, access_points, speed_limit, area_type):
+    """
+    Vectorized BasicSection.calculate_ffs, road_class given as indices of ROAD_CLASSES.
+    """
+    intercept = np.array([FFS_INTERCEPT[name] for name in ROAD_CLASSES])[road_class]
+    ffs = np.rint(intercept - 10.7 * access_points + 7.7 * area_type + 0.334 * speed_limit)
+    min_ffs = np.array([FFS_RANGE[name][0] for name in ROAD_CLASSES])[road_class]
+    max_ffs = np.array([FFS_RANGE[name][1] for name in ROAD_CLASSES])[road_class]
+    return np.clip(ffs, min_ffs, max_ffs).astype(np.int64)
+
+
+def define_u50(profile, adt, tables):
+    """
+    Vectorized BasicSection.define_u50.
+    """
+    u50 = np.full(len(adt), np.nan)
+    for name in np.unique(profile):
+        rows = profile == name
+        adt_min, adt_max, values = tables.u50_intervals(name)
+        i = np.searchsorted(adt_min, adt[rows], side='right') - 1
+        found = (i >= 0) & (adt[rows] <= np.asarray(adt_max)[np.maximum(i, 0)])
+        _check_found(found, f"ADT out of the u50 table range for profile {name}")
+        u50[rows] = np.asarray(values)[i]
+    return u50
+
+
+def calculate_k15(hourly_volume, lanes, area_type):
+    """
+    Vectorized BasicSection.calculate_k15.
+    """
+    high = hourly_volume >= K15_MIN_VOLUME
+    a = np.empty(len(hourly_volume))
+    b = np.empty(len(hourly_volume))
+    for area, (area_a, area_b) in K15_COEFFICIENTS.items():
+        a[area_type == area] = area_a
+        b[area_type == area] = area_b
+    _check_found(~high | np.isin(area_type, list(K15_COEFFICIENTS)), "Unknown area type")
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k15 = np.where(high, a + b * np.log(hourly_volume / lanes), K15_LOW_VOLUME)
+
+    # np.log can differ from math.log in the last bit, which matters only close to the rounding half
+    scaled = k15 * 100
+    near_half = high & (np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for i in np.flatnonzero(near_half):
+        k15[i] = a[i] + b[i] * math.log(hourly_volume[i] / lanes[i])
+    return python_round(k15, 2)
+
+
+def calculate_ew(road_class, lanes, gradient, hv_share, util_rate, arrays):
+    """
+    Vectorized BasicSection.calculate_ew, util_rate given as indices of UTIL_RATES.
+    """
+    es_table, ec_table = arrays[2], arrays[3]
+    max_gradient = np.searchsorted(GRADIENT_CATEGORIES[:-1], gradient, side='left')
+    # conversion factors for lanes==4 are not covered in method, factors for 3 lanes are used
+    no_of_lanes = np.where(lanes == 4, 3, lanes)
+    lanes_index = no_of_lanes - 2
+    valid_lanes = (lanes_index == 0) | (lanes_index == 1)
+    _check_found(valid_lanes, "No conversion factor for number of lanes")
+
+    es = es_table[max_gradient]
+    ec = ec_table[road_class, lanes_index, util_rate, max_gradient]
+    _check_found(~np.isnan(ec), "No heavy vehicles conversion factor")
+    return python_round(es * (1 - hv_share) + ec * hv_share, 2)
+
+
+def evaluate_batch(sections=None, **columns):
+    """
+    Calculates traffic metrics of many sections at once with vectorized NumPy operations.
+    Sections are given as a data frame (or dict of arrays) with COLUMNS, or as keyword arrays;
+    gradient is optional (0 by default). If hourly_volume column is given, it is used instead of
+    volume calculated from ADT (adt is then not needed and u50 is NaN).
+    Results are the same as for BasicSection methods:
+    - ffs, u50, hourly_volume, k15, base_capacity, flow, utilization: as calculate_* methods,
+    - ew: conversion factor used in flow (for max_util_rate 1 if estimated utilization is 0.75 or more),
+    - real_capacity: base_capacity * lanes * k15 / Ew (Ew for max_util_rate 0.75, as on the results page),
+    - avg_speed and density: NaN if capacity is exceeded (None in BasicSection),
+    - los: level of service.
+    Returns dict of arrays.
+    """
+    if sections is None:
+        sections = columns
+    given_volume = 'hourly_volume' in sections
+    size = len(sections['hourly_volume' if given_volume else 'adt'])
+    tables = get_tables()
+    arrays = _compiled_arrays(tables)
+    ffs_min, base_capacity_table = arrays[0], arrays[1]
+
+    road_class_names = _column(sections, 'road_class').astype(str)
+    road_class = np.zeros(size, dtype=np.int64)
+    for i, name in enumerate(ROAD_CLASSES):
+        road_class[road_class_names == name] = i
+    _check_found(np.isin(road_class_names, ROAD_CLASSES), "Unknown road class")
+
+    access_points = _column(sections, 'access_points').astype(float)
+    speed_limit = _column(sections, 'speed_limit').astype(float)
+    area_type = _column(sections, 'area_type')
+    hv_share = _column(sections, 'hv_share').astype(float)
+    lanes = _column(sections, 'lanes').astype(np.int64)
+    gradient = _column(sections, 'gradient', size).astype(float)
+
+    ffs = calculate_ffs(road_class, access_points, speed_limit, area_type)
+    base_capacity = base_capacity_table[road_class, ffs - ffs_min[road_class]]
+
+    if given_volume:
+        u50 = np.full(size, np.nan)
+        hourly_volume = _column(sections, 'hourly_volume').astype(np.int64)
+    else:
+        u50 = define_u50(_column(sections, 'profile').astype(str), _column(sections, 'adt'), tables)
+        hourly_volume = np.trunc(_column(sections, 'adt') * u50 / 2).astype(np.int64)
+    k15 = calculate_k15(hourly_volume, lanes, area_type)
+
+    # flow with conversion factors for estimated utilization 0.75, then for 1 if utilization is higher
+    ew_low = calculate_ew(road_class, lanes, gradient, hv_share, np.zeros(size, dtype=np.int64), arrays)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flow = np.rint(hourly_volume * ew_low / (lanes * k15))
+    high_util = flow / base_capacity >= EW_UTIL_THRESHOLD
+    ew = ew_low.copy()
+    if high_util.any():
+        ew[high_util] = calculate_ew(road_class[high_util], lanes[high_util], gradient[high_util],
+                                     hv_share[high_util], np.ones(np.count_nonzero(high_util), dtype=np.int64), arrays)
+        flow[high_util] = np.rint(hourly_volume[high_util] * ew[high_util] / (lanes[high_util] * k15[high_util]))
+    flow = flow.astype(np.int64)
+    utilization = python_round(flow / base_capacity, 2)
+    real_capacity = np.rint(base_capacity * lanes * k15 / ew_low).astype(np.int64)
+
+    # speed from Van Aerde curve, one curve for each (road_class, ffs)
+    avg_speed = np.full(size, np.nan)
+    uncongested = utilization <= 1
+    curve_keys = road_class * 1000 + ffs
+    for key in np.unique(curve_keys[uncongested]):
+        rows = uncongested & (curve_keys == key)
+        curve = curve_cache.get(ROAD_CLASSES[key // 1000], int(key % 1000))
+        avg_speed[rows] = curve.speeds_at_flows(flow[rows])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = python_round(flow / avg_speed, 1)
+    los = classify_los(density, tables)
+
+    return {
+        'ffs': ffs,
+        'u50': u50,
+        'hourly_volume': hourly_volume,
+        'k15': k15,
+        'ew': ew,
+        'flow': flow,
+        'base_capacity': base_capacity,
+        'real_capacity': real_capacity,
+        'utilization': utilization,
+        'avg_speed': avg_speed,
+        'density': density,
+        'los': los,
+    }
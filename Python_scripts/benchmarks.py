@@ -0,0 +1,240 @@
+"""
+Benchmarks of backend hot paths and of the full computation of the assessment page.
+
+Example:
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --output current.json --compare baseline.json --threshold 0.15
+
+Every benchmark is timed over a grid of road classes, lanes, gradients and ADTs and repeated
+--repeat times; the fastest repeat (min) and the median repeat are reported per call in microseconds.
+Method benchmarks time only the method itself: all other values of the section are calculated
+beforehand and only the value of the timed method is removed from the section cache.
+In compare mode, benchmarks slower than baseline by more than --threshold are reported as
+regressions and the exit code is 1.
+Cold start (import of backend and the first evaluation of a section in a new interpreter) is measured
+in subprocesses; with --import-budget the exit code is 1 if the import takes longer than the budget
+or imports pandas.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from backend import BasicSection, assess_section
+from table_registry import get_tables
+from van_aerde import curve_cache
+
+# grid of sections: (road_class, profile, speed_limit) x lanes x gradient x adt
+ROAD_CLASSES = (('A', 'DASM', 140), ('S', 'DASS', 120), ('GPG', 'DGPG', 90))
+LANES = (2, 3)
+GRADIENTS = (0, 0.03, 0.05)
+ADTS = (10000, 30000, 60000, 100000)
+
+# script run in a new interpreter: import time of backend [ms], first evaluation [ms], pandas imported
+COLD_START_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import backend
+imported = time.perf_counter()
+backend.BasicSection('S', 0.5, 100, 1, 40000, 0.1, 'DASS', 2).evaluate()
+evaluated = time.perf_counter()
+print((imported - start) * 1000, (evaluated - imported) * 1000, 'pandas' in sys.modules)
+"""
+
+# memoized methods timed with all other values already calculated
+METHODS = ('calculate_ffs', 'define_u50', 'calculate_hourly_volume', 'calculate_k15', 'estimate_base_capacity',
+           'calculate_ew', 'select_ew', 'calculate_flow', 'calculate_real_capacity', 'calculate_utilization',
+           'calculate_opt_speed', 'calculate_jam_density', 'calculate_avg_speed', 'calculate_density',
+           'assess_los', 'calculate_critical_flows')
+
+
+def benchmark_cases():
+    """
+    Returns list of BasicSection arguments of the benchmark grid.
+    """
+    return [dict(road_class=road_class, access_points=0.5, speed_limit=speed_limit, area_type=0, adt=adt,
+                 hv_share=0.15, profile=profile, lanes=lanes, gradient=gradient)
+            for (road_class, profile, speed_limit), lanes, gradient, adt in product(ROAD_CLASSES, LANES, GRADIENTS, ADTS)]
+
+
+def time_construction(case):
+    start = time.perf_counter_ns()
+    BasicSection(**case)
+    return time.perf_counter_ns() - start
+
+
+def method_timer(name):
+    def timer(case):
+        bs = BasicSection(**case)
+        bs.evaluate()
+        bs.calculate_critical_flows()
+        bs._cache.pop((name, ()), None)
+        method = getattr(bs, name)
+        start = time.perf_counter_ns()
+        method()
+        return time.perf_counter_ns() - start
+    return timer
+
+
+def time_van_aerde_calculations(case):
+    bs = BasicSection(**case)
+    bs.calculate_ffs()
+    start = time.perf_counter_ns()
+    bs.van_aerde_calculations()
+    return time.perf_counter_ns() - start
+
+
+def time_evaluate(case):
+    start = time.perf_counter_ns()
+    BasicSection(**case).evaluate()
+    return time.perf_counter_ns() - start
+
+
+def time_page_rerun(case):
+    # all calculations of pages/1_Ocena warunkow ruchu.py for one rerun (without streamlit cache)
+    start = time.perf_counter_ns()
+    assess_section(**case)
+    return time.perf_counter_ns() - start
+
+
+def benchmarks():
+    """
+    Returns dict {benchmark name: function timing one call for a case, in ns}.
+    """
+    timers = {'construction': time_construction}
+    for name in METHODS:
+        timers[name] = method_timer(name)
+    timers['van_aerde_calculations'] = time_van_aerde_calculations
+    timers['evaluate'] = time_evaluate
+    timers['page_rerun'] = time_page_rerun
+    return timers
+
+
+def cold_start(repeat=5):
+    """
+    Measures import of backend and the first evaluation of a section in new interpreters.
+    Returns dict with min and median times in ms and whether pandas was imported.
+    """
+    imports, evaluations, pandas_imported = [], [], False
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        imports.append(float(output[0]))
+        evaluations.append(float(output[1]))
+        pandas_imported = pandas_imported or output[2] == 'True'
+    return {'import_min_ms': round(min(imports), 3),
+            'import_median_ms': round(statistics.median(imports), 3),
+            'first_evaluate_min_ms': round(min(evaluations), 3),
+            'first_evaluate_median_ms': round(statistics.median(evaluations), 3),
+            'pandas_imported': pandas_imported}
+
+
+def run(repeat=5, selected=None):
+    """
+    Runs benchmarks over the grid. Returns dict with metadata and per-call times in microseconds.
+    """
+    cases = benchmark_cases()
+    # tables and curves are shared by the process, their loading is not benchmarked
+    get_tables()
+    curve_cache.prewarm()
+
+    results = {}
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for name, timer in benchmarks().items():
+            if selected and name not in selected:
+                continue
+            for case in cases:
+                timer(case)
+            totals = [sum(timer(case) for case in cases) / len(cases) / 1000 for _ in range(repeat)]
+            results[name] = {'min_us': round(min(totals), 3),
+                             'median_us': round(statistics.median(totals), 3),
+                             'calls': len(cases) * repeat}
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return {
+        'meta': {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                 'python': platform.python_version(),
+                 'platform': platform.platform(),
+                 'numpy': np.__version__,
+                 'pandas': pd.__version__,
+                 'cases': len(cases),
+                 'repeat': repeat},
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Compares min times with baseline. Returns list of (name, baseline_us, current_us, ratio, regression) tuples.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        baseline_us = baseline['results'][name]['min_us']
+        current_us = result['min_us']
+        ratio = current_us / baseline_us if baseline_us else float('inf')
+        rows.append((name, baseline_us, current_us, ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of backend calculations.")
+    parser.add_argument('--output', help="json file for results")
+    parser.add_argument('--compare', metavar='BASELINE', help="json file with baseline results")
+    parser.add_argument('--threshold', type=float, default=0.1, help="allowed slowdown against baseline (0.1 = 10%%)")
+    parser.add_argument('--repeat', type=int, default=5, help="number of repeats over the grid")
+    parser.add_argument('--only', nargs='+', metavar='NAME', help="run only given benchmarks")
+    parser.add_argument('--import-budget', type=float, metavar='MS', help="maximum import time of backend in ms")
+    args = parser.parse_args(argv)
+
+    if args.import_budget is not None:
+        startup = cold_start(repeat=args.repeat)
+        print(f"{'import backend':<28}{startup['import_min_ms']:>12.2f} ms{startup['import_median_ms']:>12.2f} ms (median)")
+        print(f"{'first evaluate':<28}{startup['first_evaluate_min_ms']:>12.2f} ms"
+              f"{startup['first_evaluate_median_ms']:>12.2f} ms (median)")
+        if startup['pandas_imported'] or startup['import_median_ms'] > args.import_budget:
+            print(f"Import budget exceeded: {startup['import_median_ms']:.2f} ms (budget {args.import_budget:.2f} ms), "
+                  f"pandas imported: {startup['pandas_imported']}", file=sys.stderr)
+            return 1
+        if not args.only and not args.output and not args.compare:
+            return 0
+
+    current = run(repeat=args.repeat, selected=args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if not args.compare:
+        for name, result in current['results'].items():
+            print(f"{name:<28}{result['min_us']:>12.2f} us{result['median_us']:>12.2f} us (median)")
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    print(f"{'benchmark':<28}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, baseline_us, current_us, ratio, regression in rows:
+        print(f"{name:<28}{baseline_us:>9.2f} us{current_us:>9.2f} us{ratio:>8.2f}{'  REGRESSION' if regression else ''}")
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Inverse calculation for capacity planning: the maximum ADT (or hourly volume) of a section for each LOS.
+
+LOS of a section is not a monotonic function of ADT, because some steps of the method are discontinuous:
+- u50 factor changes between ADT intervals of the profile (e.g. at 32000 for DASM),
+- k15 factor is constant below hourly volume 1000 and calculated from volume above it, and it is rounded,
+  so flow drops whenever rounded k15 increases,
+- conversion factors for max utilization rate 1 are used when flow reaches 0.75 of base capacity.
+The ADT range is therefore divided into pieces at these points; in each piece LOS gets worse with ADT,
+so the highest ADT with given LOS is found with bisection. The result is the highest ADT for which
+LOS is the given one or better, i.e. every higher ADT gives a worse LOS.
+All sections are calculated at once with the vectorized engine (batch.evaluate_batch).
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from batch import COLUMNS, evaluate_batch, calculate_k15
+from table_registry import get_tables
+
+MAX_ADT = 1000000
+MAX_HOURLY_VOLUME = 20000
+# LOS boundaries solved by default (LOS F has no upper limit)
+TARGET_LOS = ('A', 'B', 'C', 'D', 'E')
+
+
+@lru_cache(maxsize=32)
+def k15_steps(area_type, lanes, max_volume):
+    """
+    Returns hourly volumes (up to max_volume) at which k15 factor changes.
+    """
+    volumes = np.arange(max_volume + 1)
+    k15 = calculate_k15(volumes, np.full(len(volumes), lanes), np.full(len(volumes), area_type))
+    return tuple(np.flatnonzero(np.diff(k15)) + 1)
+
+
+def _first_hourly_volume_adt(u50, volume):
+    # the lowest ADT with int(adt * u50 / 2) >= volume
+    adt = math.ceil(2 * volume / u50)
+    while int((adt - 1) * u50 / 2) >= volume:
+        adt -= 1
+    while int(adt * u50 / 2) < volume:
+        adt += 1
+    return adt
+
+
+def _pieces(bounds, last):
+    bounds = sorted(bound for bound in set(bounds) if bound <= last) + [last + 1]
+    return [(first, next_first - 1) for first, next_first in zip(bounds[:-1], bounds[1:])]
+
+
+def volume_pieces(area_type, lanes, max_volume=MAX_HOURLY_VOLUME):
+    """
+    Returns (first, last) hourly volume ranges with constant k15.
+    """
+    return _pieces((0,) + k15_steps(area_type, lanes, max_volume), max_volume)
+
+
+def adt_pieces(profile, area_type, lanes, max_adt=MAX_ADT):
+    """
+    Returns (first, last) ADT ranges of the profile with constant u50 and k15.
+    """
+    intervals = [interval for interval in zip(*get_tables().u50_intervals(profile)) if interval[0] <= max_adt]
+    max_volume = int(max_adt * max(u50 for _, _, u50 in intervals) / 2)
+    bounds = []
+    for adt_min, adt_max, u50 in intervals:
+        bounds.append(adt_min)
+        for volume in k15_steps(area_type, lanes, max_volume):
+            adt = _first_hourly_volume_adt(u50, volume)
+            if adt_min < adt <= adt_max:
+                bounds.append(adt)
+    return _pieces(bounds, max_adt)
+
+
+def _last_true(predicate, low, high):
+    """
+    Vectorized bisection: for each row returns the highest value in [low, high] for which predicate is True,
+    if predicate is True at low and changes from True to False at most once.
+    """
+    low = low.copy()
+    high = high.copy()
+    while (low < high).any():
+        mid = (low + high + 1) // 2
+        ok = predicate(mid)
+        low = np.where(ok, mid, low)
+        high = np.where(ok, high, mid - 1)
+    return low
+
+
+def _solve(sections, variable, firsts, lasts, targets):
+    """
+    Returns dict {LOS: array of the highest value of variable (adt or hourly_volume) with that LOS or better},
+    -1 where no value of the range gives that LOS. firsts and lasts are (sections, pieces) arrays of ranges
+    with constant u50 and k15, sorted in each row (empty ranges have first > last).
+    Values of all ranges are calculated together, so the number of evaluate_batch calls does not depend
+    on the number of ranges.
+    """
+    tables = get_tables()
+    size = len(sections['road_class'])
+
+    def evaluate(rows, values):
+        # values: one value for each row, or (rows, n) array of n values for each row
+        if values.ndim == 1:
+            return evaluate_batch({**rows, variable: values})
+        results = evaluate_batch({**{name: np.repeat(column, values.shape[1]) for name, column in rows.items()},
+                                  variable: values.ravel()})
+        return {name: result.reshape(values.shape) for name, result in results.items()}
+
+    def los_rank(los):
+        rank = np.empty(los.shape, dtype=np.int64)
+        for i, label in enumerate(tables.los_labels):
+            rank[los == label] = i
+        return rank
+
+    # split pieces at the switch of conversion factor (flow at Ew for 0.75 reaching 0.75 of base capacity);
+    # at value 0 conversion factor for max utilization rate 0.75 is used
+    valid = firsts <= lasts
+    ew_low = evaluate(sections, np.zeros(size, dtype=np.int64))['ew'][:, None]
+    switched = evaluate(sections, np.hstack([np.where(valid, firsts, 0), np.where(valid, lasts, 0)]))['ew'] != ew_low
+    switched_at_first, switched_at_last = np.hsplit(switched, 2)
+    last_low = np.where(switched_at_first, firsts - 1, lasts)
+    row, piece = np.nonzero(valid & switched_at_last & ~switched_at_first)
+    if len(row):
+        switch_rows = {name: column[row] for name, column in sections.items()}
+        last_low[row, piece] = _last_true(lambda values: evaluate(switch_rows, values)['ew'] == ew_low[row, 0],
+                                          firsts[row, piece], lasts[row, piece])
+    range_firsts = np.stack([firsts, last_low + 1], axis=2).reshape(size, -1)
+    range_lasts = np.stack([last_low, lasts], axis=2).reshape(size, -1)
+
+    # the highest range with target LOS (or better) at its first value contains the result
+    nonempty = range_firsts <= range_lasts
+    rank = los_rank(evaluate(sections, np.where(nonempty, range_firsts, 0))['los'])
+    target_rank = np.array([tables.los_labels.index(los) for los in targets])
+    ok = nonempty[:, None, :] & (rank[:, None, :] <= target_rank[None, :, None])
+    found = ok.any(axis=2).ravel()
+    last_ok = ok.shape[2] - 1 - ok[:, :, ::-1].argmax(axis=2)
+    low = np.take_along_axis(range_firsts, last_ok, axis=1).ravel()
+    high = np.take_along_axis(range_lasts, last_ok, axis=1).ravel()
+
+    # each section is repeated for each target LOS
+    rows = {name: np.repeat(column, len(targets)) for name, column in sections.items()}
+    rank_limit = np.tile(target_rank, size)
+    result = _last_true(lambda values: los_rank(evaluate(rows, values)['los']) <= rank_limit,
+                        np.where(found, low, 0), np.where(found, high, 0))
+    result = np.where(found, result, -1).reshape(size, len(targets))
+    return {los: result[:, i] for i, los in enumerate(targets)}
+
+
+def _section_columns(sections, skip=('adt',)):
+    return {name: np.asarray(sections[name]) for name in COLUMNS if name not in skip and name in sections}
+
+
+def _piece_arrays(groups, pieces):
+    """
+    Returns (sections, pieces) arrays of first and last values of pieces(*group) for each row group,
+    padded at the beginning with empty ranges.
+    """
+    group_pieces = {group: pieces(*group) for group in set(groups)}
+    count = max(len(ranges) for ranges in group_pieces.values())
+    firsts = np.ones((len(groups), count), dtype=np.int64)
+    lasts = np.zeros((len(groups), count), dtype=np.int64)
+    for i, group in enumerate(groups):
+        ranges = np.array(group_pieces[group])
+        firsts[i, count - len(ranges):] = ranges[:, 0]
+        lasts[i, count - len(ranges):] = ranges[:, 1]
+    return firsts, lasts
+
+
+def max_adt(sections=None, targets=TARGET_LOS, max_adt=MAX_ADT, **columns):
+    """
+    Calculates the highest ADT with each target LOS (or better) for many sections at once.
+    Sections are given as a data frame (or dict of arrays) with COLUMNS except adt, or as keyword arrays.
+    Returns dict {LOS: array of ADT}; -1 if the section does not reach the LOS even at ADT 0.
+    """
+    if sections is None:
+        sections = columns
+    sections = _section_columns(sections)
+    groups = list(zip(sections['profile'].astype(str).tolist(), sections['area_type'].tolist(), sections['lanes'].tolist()))
+    firsts, lasts = _piece_arrays(groups, lambda profile, area_type, lanes: adt_pieces(profile, area_type, lanes, max_adt))
+    return _solve(sections, 'adt', firsts, lasts, targets)
+
+
+def max_hourly_volume(sections=None, targets=TARGET_LOS, max_volume=MAX_HOURLY_VOLUME, **columns):
+    """
+    Calculates the highest hourly volume (one direction) with each target LOS (or better) for many sections at once.
+    Sections are given as in max_adt (profile is not needed). Returns dict {LOS: array of hourly volumes}.
+    """
+    if sections is None:
+        sections = columns
+    sections = _section_columns(sections, skip=('adt', 'profile'))
+    groups = list(zip(sections['area_type'].tolist(), sections['lanes'].tolist()))
+    firsts, lasts = _piece_arrays(groups, lambda area_type, lanes: volume_pieces(area_type, lanes, max_volume))
+    return _solve(sections, 'hourly_volume', firsts, lasts, targets)
+
+
+def max_adt_for_los(road_class, access_points, speed_limit, area_type, hv_share, profile, lanes, gradient=0,
+                    targets=TARGET_LOS):
+    """
+    Returns dict {LOS: the highest ADT with that LOS or better} for one section.
+    """
+    results = max_adt(road_class=[road_class], access_points=[access_points], speed_limit=[speed_limit],
+                      area_type=[area_type], hv_share=[hv_share], profile=[profile], lanes=[lanes],
+                      gradient=[gradient], targets=targets)
+    return {los: int(adt[0]) for los, adt in results.items()}
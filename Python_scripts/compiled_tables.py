@@ -0,0 +1,281 @@
+"""
+Method tables compiled into dense NumPy arrays, saved as a directory of .npy files and loaded with memory mapping.
+
+Example:
+    python compiled_tables.py                      # compiles to data_tables/compiled
+    bundle = load_compiled()                       # arrays are mapped from files, not copied
+    results = evaluate_compiled(sections, bundle)
+    results = evaluate_compiled_or_batch(sections) # bundle of the process, evaluate_batch if it can't be used
+
+Every value that depends only on discrete inputs is calculated at compile time:
+- ffs_base[road_class, area_type, speed_limit]: free-flow speed without access points term,
+- base_capacity, opt_speed, jam_density and Van Aerde coefficients c1, c2, c3 [road_class, ffs - FFS_OFFSET],
+- es[gradient category], ec[road_class, lanes, utilization rate, gradient category],
+- u50 intervals of profiles, LOS boundaries,
+- critical_speed and critical_flow [road_class, ffs - FFS_OFFSET, LOS],
+- speed_by_flow[road_class, ffs - FFS_OFFSET, flow]: speed of the curve for each integer flow up to capacity.
+Evaluation of a section is then array indexing and a few arithmetic operations (k15 still needs a logarithm).
+Results are the same as of batch.evaluate_batch and BasicSection.
+"""
+import json
+import math
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from backend import FFS_INTERCEPT, FFS_RANGE, GRADIENT_CATEGORIES, EW_UTIL_THRESHOLD
+from batch import ROAD_CLASSES, UTIL_RATES, _check_found, python_round, calculate_k15, evaluate_batch
+from table_registry import TABLES_DIR, get_tables
+from van_aerde import VanAerdeModel, curve_cache
+
+COMPILED_DIR = TABLES_DIR / 'compiled'
+FFS_OFFSET = min(low for low, _ in FFS_RANGE.values())
+FFS_COUNT = max(high for _, high in FFS_RANGE.values()) - FFS_OFFSET + 1
+MAX_SPEED_LIMIT = 150
+# bundles loaded by get_compiled in this process, by directory and fingerprint of the tables
+# (None - missing or out of date)
+_bundles = {}
+AREA_TYPES = (0, 1)
+LANES = (2, 3)
+
+
+def compile_arrays(tables=None):
+    """
+    Returns dict of dense arrays calculated from method tables.
+    """
+    tables = tables or get_tables()
+    shape = (len(ROAD_CLASSES), FFS_COUNT)
+    arrays = {
+        'road_classes': np.array(ROAD_CLASSES),
+        'ffs_min': np.array([FFS_RANGE[road_class][0] for road_class in ROAD_CLASSES]),
+        'ffs_max': np.array([FFS_RANGE[road_class][1] for road_class in ROAD_CLASSES]),
+        'base_capacity': np.zeros(shape, dtype=np.int64),
+        'opt_speed': np.full(shape, np.nan),
+        'jam_density': np.full(shape, np.nan),
+        'c1': np.full(shape, np.nan),
+        'c2': np.full(shape, np.nan),
+        'c3': np.full(shape, np.nan),
+    }
+
+    # free-flow speed terms of discrete inputs, in the order of BasicSection.calculate_ffs
+    speed_limit = np.arange(MAX_SPEED_LIMIT + 1)
+    arrays['ffs_base'] = np.array([[FFS_INTERCEPT[road_class] + 7.7 * area_type + 0.334 * speed_limit
+                                    for area_type in AREA_TYPES] for road_class in ROAD_CLASSES])
+
+    los_labels = tables.los_labels
+    arrays['los_labels'] = np.array(los_labels)
+    arrays['los_bounds'] = np.asarray(tables.los_bounds)
+    arrays['critical_speed'] = np.full(shape + (len(los_labels),), np.nan)
+    arrays['critical_flow'] = np.full(shape + (len(los_labels),), np.nan)
+
+    max_flow = int(math.ceil(max(tables.lookup_capacity(*key).base_capacity for key in tables.capacity_keys()) * 1.01)) + 1
+    arrays['speed_by_flow'] = np.full(shape + (max_flow + 1,), np.nan)
+    flows = np.arange(max_flow + 1)
+
+    for road_class, ffs in tables.capacity_keys():
+        if road_class not in ROAD_CLASSES:
+            continue
+        i, j = ROAD_CLASSES.index(road_class), ffs - FFS_OFFSET
+        row = tables.lookup_capacity(road_class, ffs)
+        model = VanAerdeModel(row.base_capacity, row.opt_speed, ffs, row.jam_density)
+        arrays['base_capacity'][i, j] = row.base_capacity
+        arrays['opt_speed'][i, j] = row.opt_speed
+        arrays['jam_density'][i, j] = row.jam_density
+        arrays['c1'][i, j], arrays['c2'][i, j], arrays['c3'][i, j] = model.c1, model.c2, model.c3
+
+        curve = curve_cache.get(road_class, ffs)
+        arrays['critical_speed'][i, j], arrays['critical_flow'][i, j] = curve.metrics_at_densities(tables.los_bounds)
+        arrays['speed_by_flow'][i, j] = curve.speeds_at_flows(flows)
+
+    arrays['es'] = np.array([tables.lookup_es(gradient) for gradient in GRADIENT_CATEGORIES])
+    arrays['ec'] = np.full((len(ROAD_CLASSES), len(LANES), len(UTIL_RATES), len(GRADIENT_CATEGORIES)), np.nan)
+    for i, road_class in enumerate(ROAD_CLASSES):
+        for j, lanes in enumerate(LANES):
+            for k, util_rate in enumerate(UTIL_RATES):
+                for m, gradient in enumerate(GRADIENT_CATEGORIES):
+                    try:
+                        arrays['ec'][i, j, k, m] = tables.lookup_ec(road_class, lanes, util_rate, gradient)
+                    except KeyError:
+                        pass
+
+    # u50 intervals of profiles padded to the same number of intervals
+    profiles = sorted(tables.profiles())
+    count = max(len(tables.u50_intervals(profile)[0]) for profile in profiles)
+    arrays['profiles'] = np.array(profiles)
+    arrays['u50_min'] = np.full((len(profiles), count), np.iinfo(np.int64).max)
+    arrays['u50_max'] = np.full((len(profiles), count), -1)
+    arrays['u50'] = np.full((len(profiles), count), np.nan)
+    for p, profile in enumerate(profiles):
+        adt_min, adt_max, u50 = tables.u50_intervals(profile)
+        arrays['u50_min'][p, :len(adt_min)] = adt_min
+        arrays['u50_max'][p, :len(adt_max)] = adt_max
+        arrays['u50'][p, :len(u50)] = u50
+    return arrays
+
+
+def compile_tables(directory=COMPILED_DIR):
+    """
+    Compiles method tables and saves arrays as .npy files (and meta.json with fingerprint of csv files) in directory.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    tables = get_tables()
+    arrays = compile_arrays(tables)
+    for name, values in arrays.items():
+        np.save(directory / f'{name}.npy', values)
+    meta = {'fingerprint': tables.fingerprint, 'arrays': sorted(arrays), 'ffs_offset': FFS_OFFSET}
+    (directory / 'meta.json').write_text(json.dumps(meta, indent=2))
+    return directory
+
+
+class CompiledTables:
+    """
+    Arrays of compiled tables as attributes, mapped read-only from .npy files.
+    """
+    def __init__(self, arrays, fingerprint=None):
+        self.fingerprint = fingerprint
+        for name, values in arrays.items():
+            setattr(self, name, values)
+
+
+def load_compiled(directory=COMPILED_DIR, check=True):
+    """
+    Maps compiled arrays from directory (without reading them into memory). If check is True, raises ValueError
+    when the arrays were compiled from different csv files than the current ones.
+    """
+    directory = Path(directory)
+    meta = json.loads((directory / 'meta.json').read_text())
+    if check and meta['fingerprint'] != get_tables().fingerprint:
+        raise ValueError(f"Compiled tables in {directory} are out of date, run: python compiled_tables.py")
+    arrays = {name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in meta['arrays']}
+    return CompiledTables(arrays, meta['fingerprint'])
+
+
+def get_compiled(directory=COMPILED_DIR):
+    """
+    Returns compiled tables from directory, loaded once per process and tables version (loaded again after
+    table_registry.reload_tables), or None (with a warning) when there are no compiled tables or they are out of date.
+    """
+    key = (str(directory), get_tables().fingerprint)
+    if key not in _bundles:
+        try:
+            _bundles[key] = load_compiled(directory)
+        except (OSError, KeyError, ValueError) as error:
+            print(f"Compiled tables not used, calculating with the vectorized engine: {error}", file=sys.stderr)
+            _bundles[key] = None
+    return _bundles[key]
+
+
+def _index(labels, values, message):
+    # positions of values in labels array
+    order = np.argsort(labels)
+    position = np.clip(np.searchsorted(labels, values, sorter=order), 0, len(labels) - 1)
+    index = order[position]
+    found = labels[index] == values
+    if not found.all():
+        raise KeyError(f"{message} for rows {np.flatnonzero(~found)[:10].tolist()}")
+    return index
+
+
+def evaluate_compiled(sections, bundle):
+    """
+    Calculates sections (data frame or dict of arrays with batch.COLUMNS) with compiled tables.
+    Returns dict of arrays with the same results as batch.evaluate_batch.
+    """
+    given_volume = 'hourly_volume' in sections
+    size = len(sections['hourly_volume' if given_volume else 'adt'])
+    road_class = _index(bundle.road_classes, np.asarray(sections['road_class']).astype(str), "Unknown road class")
+    access_points = np.asarray(sections['access_points'], dtype=float)
+    speed_limit = np.asarray(sections['speed_limit'], dtype=float)
+    area_type = np.asarray(sections['area_type'])
+    _check_found(np.isin(area_type, AREA_TYPES), "Unknown area type")
+    area_type = area_type.astype(np.int64)
+    hv_share = np.asarray(sections['hv_share'], dtype=float)
+    lanes = np.asarray(sections['lanes'])
+    # 4 lanes use conversion factors of 3 lanes
+    _check_found(np.isin(lanes, LANES + (4,)), "No conversion factor for number of lanes")
+    lanes = lanes.astype(np.int64)
+    gradient = np.asarray(sections['gradient'], dtype=float) if 'gradient' in sections else np.zeros(size)
+
+    # free-flow speed, values close to half (and speed limits out of the table) are calculated in the original order
+    in_table = (speed_limit == np.rint(speed_limit)) & (speed_limit >= 0) & (speed_limit <= MAX_SPEED_LIMIT)
+    limit_index = np.where(in_table, speed_limit, 0).astype(np.int64)
+    ffs = bundle.ffs_base[road_class, area_type, limit_index] - 10.7 * access_points
+    recalculate = ~in_table | (np.abs(ffs - np.floor(ffs) - 0.5) < 1e-6)
+    if recalculate.any():
+        intercept = np.array([FFS_INTERCEPT[name] for name in ROAD_CLASSES])[road_class[recalculate]]
+        ffs[recalculate] = (intercept - 10.7 * access_points[recalculate] + 7.7 * area_type[recalculate]
+                            + 0.334 * speed_limit[recalculate])
+    ffs = np.clip(np.rint(ffs), bundle.ffs_min[road_class], bundle.ffs_max[road_class]).astype(np.int64)
+    ffs_index = ffs - FFS_OFFSET
+    base_capacity = bundle.base_capacity[road_class, ffs_index]
+
+    if given_volume:
+        u50 = np.full(size, np.nan)
+        hourly_volume = np.asarray(sections['hourly_volume']).astype(np.int64)
+    else:
+        # u50 interval of the profile
+        adt = np.asarray(sections['adt'])
+        profile = _index(bundle.profiles, np.asarray(sections['profile']).astype(str), "Unknown profile")
+        interval = (bundle.u50_min[profile] <= adt[:, None]).sum(axis=1) - 1
+        interval_max = bundle.u50_max[profile, np.maximum(interval, 0)]
+        if ((interval < 0) | (adt > interval_max)).any():
+            raise KeyError("ADT out of the u50 table range")
+        u50 = bundle.u50[profile, interval]
+        hourly_volume = np.trunc(adt * u50 / 2).astype(np.int64)
+    k15 = calculate_k15(hourly_volume, lanes, area_type)
+
+    # conversion factors
+    max_gradient = np.searchsorted(GRADIENT_CATEGORIES[:-1], gradient, side='left')
+    lanes_index = np.where(lanes == 4, 3, lanes) - LANES[0]
+    es = bundle.es[max_gradient]
+    ew_low = python_round(es * (1 - hv_share) + bundle.ec[road_class, lanes_index, 0, max_gradient] * hv_share, 2)
+    ew_high = python_round(es * (1 - hv_share) + bundle.ec[road_class, lanes_index, 1, max_gradient] * hv_share, 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        flow = np.rint(hourly_volume * ew_low / (lanes * k15))
+        high_util = flow / base_capacity >= EW_UTIL_THRESHOLD
+        ew = np.where(high_util, ew_high, ew_low)
+        flow = np.where(high_util, np.rint(hourly_volume * ew / (lanes * k15)), flow)
+    if np.isnan(ew_low).any() or np.isnan(ew[high_util]).any():
+        raise KeyError("No heavy vehicles conversion factor")
+    flow = flow.astype(np.int64)
+    utilization = python_round(flow / base_capacity, 2)
+    real_capacity = np.rint(base_capacity * lanes * k15 / ew_low).astype(np.int64)
+
+    # speed from the table of the curve for integer flows
+    uncongested = utilization <= 1
+    avg_speed = np.full(size, np.nan)
+    avg_speed[uncongested] = bundle.speed_by_flow[road_class[uncongested], ffs_index[uncongested], flow[uncongested]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        density = python_round(flow / avg_speed, 1)
+    los_index = np.searchsorted(bundle.los_bounds, density, side='left')
+    los_index = np.where(np.isnan(density) | (los_index >= len(bundle.los_labels)), len(bundle.los_labels) - 1, los_index)
+
+    return {
+        'ffs': ffs,
+        'u50': u50,
+        'hourly_volume': hourly_volume,
+        'k15': k15,
+        'ew': ew,
+        'flow': flow,
+        'base_capacity': base_capacity,
+        'real_capacity': real_capacity,
+        'utilization': utilization,
+        'avg_speed': avg_speed,
+        'density': density,
+        'los': bundle.los_labels[los_index].astype(object),
+    }
+
+
+def evaluate_compiled_or_batch(sections, directory=COMPILED_DIR):
+    """
+    Calculates sections with compiled tables of get_compiled, or with batch.evaluate_batch when they can't be used.
+    """
+    bundle = get_compiled(directory)
+    return evaluate_batch(sections) if bundle is None else evaluate_compiled(sections, bundle)
+
+
+if __name__ == '__main__':
+    print(f"Compiled tables saved in {compile_tables(*sys.argv[1:])}")
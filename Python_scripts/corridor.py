@@ -0,0 +1,158 @@
+"""
+Corridor as an ordered chain of basic sections (segments) with corridor totals kept up to date incrementally.
+
+Each segment is a BasicSection with its length in km. Results of segments are stored, and when inputs of
+one segment are edited only that segment is calculated again (BasicSection clears its values when an input
+is reassigned). Totals are updated by removing the previous contribution of the segment and adding the new one:
+- travel time and length in each LOS are sums,
+- minimum capacity (bottleneck) is kept in a heap; entries of edited segments become stale and are
+  skipped when the minimum is read.
+"""
+import heapq
+import math
+from collections import namedtuple
+
+from backend import BasicSection
+
+CorridorSummary = namedtuple('CorridorSummary', ['segments', 'length', 'travel_time', 'mean_speed', 'bottleneck',
+                                                 'min_capacity', 'los_length', 'weighted_los', 'congested_segments'])
+
+
+class Corridor:
+    """
+    Ordered segments of a corridor. Travel time of a congested segment (capacity exceeded) is calculated
+    with optimal speed of the segment, so for congested corridors it is a lower bound.
+    """
+    def __init__(self, segments=()):
+        self.sections = []
+        self.lengths = []
+        self.results = []
+        self._times = []
+        self._versions = []
+        self._capacity_heap = []
+        self.tables = None
+        self.length = 0.0
+        self.travel_time = 0.0
+        self.los_length = {}
+        self.congested_segments = 0
+        for inputs, length in segments:
+            self.add(inputs, length)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def add(self, inputs, length):
+        """
+        Appends segment with BasicSection inputs (dict) and length in km. Returns index of the segment.
+        If the inputs can't be calculated, the error is raised and the corridor is not changed.
+        """
+        # the new section is calculated before it is added
+        section = BasicSection(**inputs)
+        section.evaluate()
+        if self.tables is None:
+            self.tables = section.tables
+            self.los_length = dict.fromkeys(self.tables.los_labels, 0.0)
+        self.sections.append(section)
+        self.lengths.append(length)
+        self.results.append(None)
+        self._times.append(0.0)
+        self._versions.append(0)
+        index = len(self.sections) - 1
+        self._calculate(index)
+        return index
+
+    def update(self, index, length=None, **inputs):
+        """
+        Changes inputs (e.g. lanes=3) and/or length of the segment. The segment is calculated again
+        only if any input has a new value. Returns result of the segment.
+        If the new inputs can't be calculated, the error is raised and the segment and totals are not changed.
+        """
+        section = self.sections[index]
+        changed = {name: value for name, value in inputs.items() if getattr(section, name) != value}
+        if not changed and (length is None or length == self.lengths[index]):
+            return self.results[index]
+
+        # the edited section is calculated before the totals are changed
+        previous = {name: getattr(section, name) for name in changed}
+        for name, value in changed.items():
+            setattr(section, name, value)
+        try:
+            section.evaluate()
+        except Exception:
+            for name, value in previous.items():
+                setattr(section, name, value)
+            raise
+
+        self._remove_contribution(index)
+        if length is not None:
+            self.lengths[index] = length
+        self._calculate(index)
+        return self.results[index]
+
+    def _segment_time(self, index):
+        result = self.results[index]
+        speed = self.sections[index].calculate_opt_speed() if result.congested else result.avg_speed
+        return self.lengths[index] / speed
+
+    def _remove_contribution(self, index):
+        result = self.results[index]
+        self.length -= self.lengths[index]
+        self.travel_time -= self._times[index]
+        self.los_length[result.los] -= self.lengths[index]
+        self.congested_segments -= result.congested
+
+    def _calculate(self, index):
+        result = self.sections[index].evaluate()
+        self.results[index] = result
+        self._times[index] = self._segment_time(index)
+        self.length += self.lengths[index]
+        self.travel_time += self._times[index]
+        self.los_length[result.los] += self.lengths[index]
+        self.congested_segments += result.congested
+
+        self._versions[index] += 1
+        heapq.heappush(self._capacity_heap, (result.real_capacity, index, self._versions[index]))
+        # rebuild the heap when most of entries are stale
+        if len(self._capacity_heap) > 4 * len(self.sections) + 64:
+            self._capacity_heap = [(segment.real_capacity, i, self._versions[i]) for i, segment in enumerate(self.results)]
+            heapq.heapify(self._capacity_heap)
+
+    def bottleneck(self):
+        """
+        Returns (index, capacity) of the segment with the lowest capacity.
+        """
+        heap = self._capacity_heap
+        while heap and heap[0][2] != self._versions[heap[0][1]]:
+            heapq.heappop(heap)
+        if not heap:
+            return None, math.nan
+        capacity, index, _ = heap[0]
+        return index, capacity
+
+    def weighted_los(self):
+        """
+        Returns LOS of the corridor as length-weighted mean of LOS of segments (A=0 ... F=5), rounded to the closest LOS.
+        """
+        if not self.length:
+            return None
+        labels = self.tables.los_labels
+        mean_rank = sum(rank * self.los_length[label] for rank, label in enumerate(labels)) / self.length
+        return labels[min(int(mean_rank + 0.5), len(labels) - 1)]
+
+    def summary(self):
+        """
+        Returns CorridorSummary: length [km], travel time [min], mean speed [km/h], bottleneck segment index and
+        its capacity [veh/h], length in each LOS [km], length-weighted LOS and number of congested segments.
+        """
+        bottleneck, min_capacity = self.bottleneck()
+        return CorridorSummary(
+            segments=len(self.sections),
+            length=self.length,
+            travel_time=self.travel_time * 60,
+            mean_speed=self.length / self.travel_time if self.travel_time else math.nan,
+            bottleneck=bottleneck,
+            min_capacity=min_capacity,
+            los_length=dict(self.los_length),
+            weighted_los=self.weighted_los(),
+            congested_segments=self.congested_segments,
+        )
@@ -0,0 +1,221 @@
+"""
+Opt-in instrumentation of backend calculations:
+- number of calls and cumulative wall time of BasicSection methods,
+- number of method table lookups,
+- number of Van Aerde curves built.
+
+Calls are collected inside the instrumented() context manager, separately for each thread (context), or
+for the whole process with enable() / environment variable TRAFFIC_INSTRUMENTATION=1 (checked when backend
+is imported). Methods are wrapped only while any collection is active, so otherwise there is no overhead.
+
+Example:
+    with instrumented() as stats:
+        BasicSection(...).evaluate()
+    print(stats.to_json())
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+from backend import BasicSection
+from table_registry import Tables
+from van_aerde import VanAerdeCurve, curve_cache
+
+ENV_VAR = 'TRAFFIC_INSTRUMENTATION'
+
+# timed BasicSection methods: calculate_*, define_*, the rest of the calculation chain and van_aerde_calculations
+METHODS = tuple(sorted(
+    name for name in vars(BasicSection)
+    if name.startswith(('calculate_', 'define_'))
+    or name in ('estimate_base_capacity', 'select_ew', 'assess_los', 'evaluate', 'van_aerde_calculations')))
+
+# counted Tables methods
+LOOKUPS = ('lookup_u50', 'u50_intervals', 'lookup_capacity', 'lookup_los_density', 'lookup_es', 'lookup_ec')
+
+
+class Stats:
+    """
+    Counters of one collection (thread-safe).
+    Method times are cumulative, i.e. include time of the methods called inside (also when the result comes from cache).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.method_calls = dict.fromkeys(METHODS, 0)
+            self.method_time = dict.fromkeys(METHODS, 0.0)
+            self.lookups = dict.fromkeys(LOOKUPS, 0)
+            self.curve_builds = 0
+
+    def add_call(self, name, elapsed):
+        with self._lock:
+            self.method_calls[name] += 1
+            self.method_time[name] += elapsed
+
+    def add_lookup(self, name):
+        with self._lock:
+            self.lookups[name] += 1
+
+    def add_curve_build(self):
+        with self._lock:
+            self.curve_builds += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'methods': {name: {'calls': self.method_calls[name], 'total_s': round(self.method_time[name], 6)}
+                            for name in METHODS if self.method_calls[name]},
+                'lookups': {name: count for name, count in self.lookups.items() if count},
+                'curve_builds': self.curve_builds,
+                'curve_cache': curve_cache.stats(),
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+# counters of the whole process (enable() / TRAFFIC_INSTRUMENTATION) and counters of the current context
+# (instrumented() block); threads and asyncio tasks have separate contexts, so e.g. Streamlit sessions
+# running in parallel collect their own counters
+stats = Stats()
+_active = contextvars.ContextVar('instrumentation_stats', default=None)
+_process_wide = False
+
+# wrappers are installed while the process-wide collection or any instrumented() block is active
+_originals = {}
+_users = 0
+_lock = threading.Lock()
+
+
+def _current():
+    collector = _active.get()
+    if collector is None and _process_wide:
+        return stats
+    return collector
+
+
+def _timed(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        collector = _current()
+        if collector is None:
+            return method(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            collector.add_call(name, time.perf_counter() - start)
+    return wrapper
+
+
+def _counted(name, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        collector = _current()
+        if collector is not None:
+            collector.add_lookup(name)
+        return method(*args, **kwargs)
+    return wrapper
+
+
+def _counted_curve_init(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        collector = _current()
+        if collector is not None:
+            collector.add_curve_build()
+        return method(*args, **kwargs)
+    return wrapper
+
+
+def _install():
+    global _users
+    with _lock:
+        _users += 1
+        if _users > 1:
+            return
+        for name in METHODS:
+            _originals[(BasicSection, name)] = vars(BasicSection)[name]
+            setattr(BasicSection, name, _timed(name, vars(BasicSection)[name]))
+        for name in LOOKUPS:
+            _originals[(Tables, name)] = vars(Tables)[name]
+            setattr(Tables, name, _counted(name, vars(Tables)[name]))
+        _originals[(VanAerdeCurve, '__init__')] = VanAerdeCurve.__init__
+        VanAerdeCurve.__init__ = _counted_curve_init(VanAerdeCurve.__init__)
+
+
+def _uninstall():
+    global _users
+    with _lock:
+        _users -= 1
+        if _users > 0:
+            return
+        for (cls, name), method in _originals.items():
+            setattr(cls, name, method)
+        _originals.clear()
+
+
+def is_enabled():
+    """
+    Returns True if calls in the current context are collected.
+    """
+    return _current() is not None
+
+
+def enable():
+    """
+    Collects calls of the whole process (outside instrumented() blocks) in stats. Counters are not reset.
+    """
+    global _process_wide
+    if not _process_wide:
+        _process_wide = True
+        _install()
+
+
+def disable():
+    """
+    Stops the process-wide collection. Collected counters are kept until reset(); instrumented() blocks
+    which are still running are not affected.
+    """
+    global _process_wide
+    if _process_wide:
+        _process_wide = False
+        _uninstall()
+
+
+def reset():
+    stats.reset()
+
+
+def snapshot():
+    """
+    Returns counters collected by the whole process as dict.
+    """
+    return stats.to_dict()
+
+
+@contextlib.contextmanager
+def instrumented(reset_stats=True):
+    """
+    Collects calls made in the current context (thread or task) inside the block. Yields Stats: new counters,
+    or, with reset_stats=False, the counters of the block around it (or of the whole process) to add to them.
+    Other threads, e.g. other Streamlit sessions, neither see nor change these counters.
+    """
+    collector = Stats() if reset_stats else (_current() or stats)
+    token = _active.set(collector)
+    _install()
+    try:
+        yield collector
+    finally:
+        _active.reset(token)
+        _uninstall()
+
+
+if os.environ.get(ENV_VAR):
+    enable()
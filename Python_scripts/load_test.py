@@ -0,0 +1,123 @@
+"""
+Load test of api_server.py: sends requests from concurrent keep-alive connections and reports
+latency percentiles and throughput.
+
+Example:
+    python load_test.py --url http://127.0.0.1:8000 --endpoint section --connections 16 --requests 5000
+    python load_test.py --endpoint batch --batch-size 2000 --connections 4 --requests 100
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+SPEED_LIMITS = {'A': (140, 130, 120, 110, 100), 'S': (120, 110, 100, 90), 'GPG': (110, 100, 90, 80)}
+
+
+def random_section(rng):
+    road_class = rng.choice(tuple(SPEED_LIMITS))
+    return {'road_class': road_class,
+            'access_points': round(rng.uniform(0, 2.5), 1),
+            'speed_limit': rng.choice(SPEED_LIMITS[road_class]),
+            'area_type': rng.choice((0, 1)),
+            'adt': rng.randint(5000, 120000),
+            'hv_share': round(rng.uniform(0, 0.4), 2),
+            'profile': 'DGPG' if road_class == 'GPG' else rng.choice(('DASM', 'DASS', 'DASD')),
+            'lanes': rng.choice((2, 3, 4)),
+            'gradient': rng.choice((0, 0.03, 0.05))}
+
+
+def build_request(host, endpoint, rng, batch_size):
+    if endpoint == 'section':
+        method, path, body = 'POST', '/section', random_section(rng)
+    elif endpoint == 'batch':
+        method, path, body = 'POST', '/batch', {'sections': [random_section(rng) for _ in range(batch_size)]}
+    elif endpoint == 'curve':
+        road_class, ffs = rng.choice((('A', rng.randint(90, 130)), ('S', rng.randint(90, 120)), ('GPG', rng.randint(80, 110))))
+        method, path, body = 'GET', f'/curve?road_class={road_class}&ffs={ffs}', None
+    else:
+        method, path, body = 'GET', f'/{endpoint}', None
+    payload = json.dumps(body).encode() if body is not None else b''
+    return (f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n").encode() + payload
+
+
+async def read_response(reader):
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def connection(host, port, requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for request in requests:
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(url, endpoint, connections, requests, batch_size, seed=0):
+    """
+    Sends requests in total from connections concurrent connections. Returns dict with report.
+    """
+    address = urlsplit(url)
+    rng = random.Random(seed)
+    # requests are prepared before the test, so only sending and waiting is measured
+    per_connection = [[build_request(address.netloc, endpoint, rng, batch_size)
+                       for _ in range(requests // connections + (i < requests % connections))]
+                      for i in range(connections)]
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(connection(address.hostname, address.port or 80, chunk, latencies, errors)
+                           for chunk in per_connection))
+    elapsed = time.perf_counter() - start
+
+    latency = np.array(latencies) * 1000
+    sections = batch_size if endpoint == 'batch' else 1
+    return {'endpoint': endpoint,
+            'connections': connections,
+            'requests': len(latencies),
+            'errors': len(errors),
+            'elapsed_s': round(elapsed, 3),
+            'requests_per_s': round(len(latencies) / elapsed, 1),
+            'sections_per_s': round(len(latencies) * sections / elapsed, 1),
+            'p50_ms': round(float(np.percentile(latency, 50)), 3),
+            'p90_ms': round(float(np.percentile(latency, 90)), 3),
+            'p99_ms': round(float(np.percentile(latency, 99)), 3),
+            'max_ms': round(float(latency.max()), 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the HTTP API.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--endpoint', choices=['section', 'batch', 'curve', 'health'], default='section')
+    parser.add_argument('--connections', type=int, default=8, help="number of concurrent connections")
+    parser.add_argument('--requests', type=int, default=1000, help="total number of requests")
+    parser.add_argument('--batch-size', type=int, default=1000, help="sections in one batch request")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(args.url, args.endpoint, args.connections, args.requests, args.batch_size, args.seed))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
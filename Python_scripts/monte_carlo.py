@@ -0,0 +1,136 @@
+"""
+Monte Carlo analysis of uncertainty of traffic conditions.
+
+Inputs of BasicSection are given as fixed values or as distributions (tuples):
+    ('normal', mean, sd)
+    ('lognormal', mean, sigma)          - mean and sigma of the underlying normal distribution
+    ('uniform', low, high)
+    ('triangular', left, mode, right)
+    ('choice', values, probabilities)   - probabilities are optional
+Samples are drawn in chunks, each chunk with its own random generator spawned from one SeedSequence,
+so results depend only on seed, n and chunksize (not on the number of worker processes).
+Every chunk is calculated with the vectorized engine (batch.evaluate_batch).
+
+Example:
+    simulate({'road_class': 'S', 'access_points': ('uniform', 0.3, 0.8), 'speed_limit': 120, 'area_type': 1,
+              'adt': ('normal', 42000, 5000), 'hv_share': ('triangular', 0.1, 0.15, 0.25), 'profile': 'DASM',
+              'lanes': 2, 'gradient': 0}, n=100000, seed=2035)
+"""
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch import COLUMNS, evaluate_batch
+from table_registry import get_tables
+
+# limits of sampled values, integer inputs are rounded
+LIMITS = {'access_points': (0, None), 'adt': (0, 1000000), 'hv_share': (0, 1), 'gradient': (0, None), 'lanes': (2, 4)}
+INTEGER_INPUTS = ('adt', 'lanes', 'area_type', 'speed_limit')
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+METRICS = ('avg_speed', 'density', 'utilization')
+
+MonteCarloResult = namedtuple('MonteCarloResult', ['n', 'los_probability', 'exceedance_probability',
+                                                   'congested_probability', 'quantiles', 'diagnostics'])
+
+
+def draw(rng, spec, size):
+    """
+    Returns size samples of distribution spec (or spec repeated, if it is a fixed value).
+    """
+    if not isinstance(spec, tuple):
+        return np.full(size, spec)
+    kind, *parameters = spec
+    if kind == 'normal':
+        return rng.normal(*parameters, size=size)
+    if kind == 'lognormal':
+        return rng.lognormal(*parameters, size=size)
+    if kind == 'uniform':
+        return rng.uniform(*parameters, size=size)
+    if kind == 'triangular':
+        return rng.triangular(*parameters, size=size)
+    if kind == 'choice':
+        values, probabilities = (parameters + [None])[:2]
+        return rng.choice(np.asarray(values), size=size, p=probabilities)
+    raise ValueError(f"Unknown distribution: {kind}")
+
+
+def draw_sections(inputs, rng, size):
+    """
+    Returns dict of arrays with size sampled sections.
+    """
+    sections = {}
+    for name in COLUMNS:
+        if name not in inputs:
+            continue
+        values = draw(rng, inputs[name], size)
+        if name in LIMITS:
+            values = np.clip(values, *LIMITS[name])
+        if name in INTEGER_INPUTS and values.dtype.kind == 'f':
+            values = np.rint(values).astype(np.int64)
+        sections[name] = values
+    return sections
+
+
+def _simulate_chunk(inputs, seed, size):
+    # LOS counts and metrics of one chunk of samples
+    rng = np.random.default_rng(seed)
+    results = evaluate_batch(draw_sections(inputs, rng, size))
+    labels = get_tables().los_labels
+    counts = np.array([np.count_nonzero(results['los'] == label) for label in labels])
+    return counts, {metric: results[metric].astype(float) for metric in METRICS}
+
+
+def _quantiles(values, quantiles):
+    # quantiles of values without NaN (speed and density of congested samples)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return dict.fromkeys(quantiles, np.nan)
+    return dict(zip(quantiles, np.quantile(values, quantiles).tolist()))
+
+
+def simulate(inputs, n=100000, seed=None, chunksize=20000, workers=1, quantiles=QUANTILES):
+    """
+    Draws n sections from inputs (dict of fixed values and distributions) and calculates them.
+    Returns MonteCarloResult:
+    - los_probability {LOS: P(LOS)}, exceedance_probability {LOS: P(LOS or worse)}, congested_probability,
+    - quantiles {metric: {q: value}} of avg_speed and density (of uncongested samples) and utilization,
+    - diagnostics: seed, number of chunks, standard errors of LOS probabilities, probabilities after each
+      chunk (to check convergence) and the largest change of them in the second half of chunks.
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    sizes = [min(chunksize, n - start) for start in range(0, n, chunksize)]
+    seeds = seed_sequence.spawn(len(sizes))
+    tasks = [(inputs, chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = list(executor.map(_simulate_chunk, *zip(*tasks)))
+    else:
+        chunks = [_simulate_chunk(*task) for task in tasks]
+
+    labels = get_tables().los_labels
+    chunk_counts = np.array([counts for counts, _ in chunks])
+    counts = chunk_counts.sum(axis=0)
+    probability = counts / n
+    metrics = {metric: np.concatenate([values[metric] for _, values in chunks]) for metric in METRICS}
+
+    # probabilities after each chunk
+    running = np.cumsum(chunk_counts, axis=0) / np.cumsum(sizes)[:, None]
+    second_half = running[len(running) // 2:]
+
+    return MonteCarloResult(
+        n=n,
+        los_probability=dict(zip(labels, probability.tolist())),
+        exceedance_probability=dict(zip(labels, (np.cumsum(counts[::-1])[::-1] / n).tolist())),
+        congested_probability=float(np.isnan(metrics['avg_speed']).mean()),
+        quantiles={metric: _quantiles(values, quantiles) for metric, values in metrics.items()},
+        diagnostics={
+            'seed': seed_sequence.entropy,
+            'chunks': len(sizes),
+            'standard_error': dict(zip(labels, np.sqrt(probability * (1 - probability) / n).tolist())),
+            'running_probability': {label: running[:, i].tolist() for i, label in enumerate(labels)},
+            'max_change_second_half': float(np.abs(second_half - probability).max()),
+        },
+    )
@@ -1,5 +1,8 @@
 import streamlit as st
-from backend import BasicSection
+from backend import assess_section
+from table_registry import get_tables
+from van_aerde import curve_cache
+import instrumentation
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
@@ -18,6 +21,23 @@ if not st.session_state.get("logged_in", False):
     st.error("🚫 Brak dostępu. Wróć na stronę główną i zaloguj się.")
     st.stop()
 
+# method tables and Van Aerde curves shared by all sessions
+@st.cache_resource
+def load_shared_tables():
+    tables = get_tables()
+    curve_cache.prewarm()
+    return tables
+
+# results for one set of inputs, calculated once and reused by all sessions
+@st.cache_data(ttl=3600, max_entries=1000, show_spinner=False)
+def calculate_results(road_class, access_points, speed_limit, area_type, adt, hv_share, profile, lanes, gradient,
+                      input_hourly_volume):
+    return assess_section(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type, 
+                          adt=adt, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient, 
+                          input_hourly_volume=input_hourly_volume)
+
+load_shared_tables()
+
 # sidebar
 with st.sidebar:
     st.subheader(':oncoming_automobile: Dane wejściowe')
@@ -130,30 +150,36 @@ with st.sidebar:
                                     """
                                     )
 
+    debug = st.checkbox('Panel diagnostyczny', value=False,
+                        help="""
+                        Obliczenia są wykonywane bez pamięci podręcznej, a pod wynikami wyświetlana jest liczba wywołań 
+                        i czas obliczeń poszczególnych metod oraz liczba odczytów z tablic.
+                        """
+                        )
 
 
-col = st.columns((2, 6, 2), gap='medium')
 
-bs = BasicSection(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type, adt=adt, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient)
+col = st.columns((2, 6, 2), gap='medium')
 
-if volume_type != 'SDR [P/24h]':
-    adt_from_volume = bs.calculate_adt_from_volume(input_hourly_volume)
-    bs = BasicSection(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type, adt=adt_from_volume, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient)
+inputs = dict(road_class=road_class, access_points=access_points, speed_limit=speed_limit, area_type=area_type, 
+              adt=adt, hv_share=hv_share, profile=profile, lanes=lanes, gradient=gradient,
+              input_hourly_volume=None if volume_type == 'SDR [P/24h]' else input_hourly_volume)
 
-df = bs.van_aerde_calculations()
-df = df[df['density'] <= 26.5]
+if debug:
+    # calculations without cache, with instrumentation of backend methods
+    with instrumentation.instrumented() as debug_stats:
+        results = assess_section(**inputs)
+else:
+    results = calculate_results(**inputs)
 
 with col[0]:
-    if volume_type == 'SDR [P/24h]':
-        hourly_volume = bs.calculate_hourly_volume()
-    else:
-        hourly_volume = input_hourly_volume
-    if bs.calculate_avg_speed() != None:
-        avg_speed = round(bs.calculate_avg_speed(), 1)
-    ffs_speed = bs.calculate_ffs()
-    hourly_flow = bs.calculate_flow()
-    base_capacity = bs.estimate_base_capacity()
-    real_capacity = round(base_capacity * lanes * bs.calculate_k15() / bs.calculate_ew())
+    hourly_volume = results.hourly_volume
+    if results.avg_speed != None:
+        avg_speed = round(results.avg_speed, 1)
+    ffs_speed = results.ffs
+    hourly_flow = results.flow
+    base_capacity = results.base_capacity
+    real_capacity = results.real_capacity
     
     st.markdown('###### Parametry przekroju')
 
@@ -184,14 +210,14 @@ with col[0]:
     st.markdown('###### Parametry modelu')
     
     st.metric(label='*V$_{sw}$* [km/h]', value=f"{ffs_speed}")
-    st.metric(label="*V$_{op}$* [E/km/pas]", value=bs.calculate_opt_speed())
+    st.metric(label="*V$_{op}$* [E/km/pas]", value=results.opt_speed)
     st.metric(label='*C$_{0}$* [E/h/pas]', value=base_capacity)
-    st.metric(label="*k$_{max}$* [E/km/pas]", value=bs.calculate_jam_density())
+    st.metric(label="*k$_{max}$* [E/km/pas]", value=results.jam_density)
     
 with col[2]: 
     st.markdown('###### Warunki ruchu')
     
-    if bs.calculate_avg_speed() != None:
+    if results.avg_speed != None:
         
         st.metric(label='Prędkość swobodna *V$_{sw}$* [km/h]', 
                     value=f"{ffs_speed}")
@@ -204,16 +230,13 @@ with col[2]:
                     value=f"{round(hourly_flow/avg_speed, 1)}")
 
     st.metric(label='PSR',
-              value=f"{bs.assess_los()}", 
+              value=f"{results.los}", 
               border=True,
               help="Poziom Swobody Ruchu")
 
 with col[1]:
-    if bs.calculate_avg_speed() is not None and hourly_flow/base_capacity <= 1:
-        df_trafficx = df['volume']
-        df_trafficy = df['speed']
-
-        scat_plot = px.line(df, x=df_trafficx, y=df_trafficy)
+    if results.avg_speed is not None and hourly_flow/base_capacity <= 1:
+        scat_plot = px.line(x=results.curve_volume, y=results.curve_speed)
 
         scat_plot.update_layout(title='Zależność prędkości od natężenia ruchu', 
                                             yaxis=dict(title='Średnia prędkość V [km/h]', range=[0, 150]),
@@ -228,37 +251,18 @@ with col[1]:
                                         )
                                 )
             
+        # speed and flow at densities corresponding to LOS boundaries
+        critical_flows = {los: (speed, flow) for los, speed, flow in results.critical_flows}
+
         # line plot at densities corresponding to LOS boundaries
-        scat_plot.add_trace(go.Scatter(x=[0, bs.calculate_metrics_at_density(6.5)[1]], 
-                                        y=[0, bs.calculate_metrics_at_density(6.5)[0]], 
-                                        mode='markers+lines', 
-                                        opacity=0.5, name='costam',
-                                        showlegend=False, 
-                                        line=dict(color='royalblue', width=1, dash='dot')))
-        scat_plot.add_trace(go.Scatter(x=[0, bs.calculate_metrics_at_density(11)[1]], 
-                                        y=[0, bs.calculate_metrics_at_density(11)[0]], 
-                                        mode='markers+lines', 
-                                        opacity=0.5, name='costam',
-                                        showlegend=False, 
-                                        line=dict(color='royalblue', width=1, dash='dot')))
-        scat_plot.add_trace(go.Scatter(x=[0, bs.calculate_metrics_at_density(16)[1]], 
-                                        y=[0, bs.calculate_metrics_at_density(16)[0]], 
-                                        mode='markers+lines', 
-                                        opacity=0.5, name='costam',
-                                        showlegend=False, 
-                                        line=dict(color='royalblue', width=1, dash='dot')))
-        scat_plot.add_trace(go.Scatter(x=[0, bs.calculate_metrics_at_density(21)[1]], 
-                                        y=[0, bs.calculate_metrics_at_density(21)[0]], 
-                                        mode='markers+lines', 
-                                        opacity=0.5, name='costam',
-                                        showlegend=False, 
-                                        line=dict(color='royalblue', width=1, dash='dot')))
-        scat_plot.add_trace(go.Scatter(x=[0, bs.calculate_metrics_at_density(26.5)[1]], 
-                                        y=[0, bs.calculate_metrics_at_density(26.5)[0]], 
-                                        mode='markers+lines', 
-                                        opacity=0.5, name='costam',
-                                        showlegend=False, 
-                                        line=dict(color='royalblue', width=1, dash='dot')))
+        for los in ['A', 'B', 'C', 'D', 'E']:
+            crit_speed, crit_flow = critical_flows[los]
+            scat_plot.add_trace(go.Scatter(x=[0, crit_flow], 
+                                            y=[0, crit_speed], 
+                                            mode='markers+lines', 
+                                            opacity=0.5, name='costam',
+                                            showlegend=False, 
+                                            line=dict(color='royalblue', width=1, dash='dot')))
             
         scat_plot.add_annotation(
                 x=hourly_flow, y=avg_speed,
@@ -266,49 +270,26 @@ with col[1]:
                 showarrow=True,
                 arrowhead=2)
 
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(6.5)[1] - 350, y=bs.calculate_metrics_at_density(6.5)[0] - 10,
-                text=f"PSR A",
-                align='left',
-                showarrow=False)
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(11)[1] - 350, y=bs.calculate_metrics_at_density(11)[0] - 10,
-                text=f"PSR B",
-                align='left',
-                showarrow=False)
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(16)[1] - 350, y=bs.calculate_metrics_at_density(16)[0] - 10,
-                text=f"PSR C",
-                align='left',
-                showarrow=False)
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(21)[1] - 350, y=bs.calculate_metrics_at_density(21)[0] - 5,
-                text=f"PSR D",
-                align='left',
-                showarrow=False)
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(26.5)[1] - 200, y=bs.calculate_metrics_at_density(26.5)[0],
-                text=f"PSR E",
-                align='left',
-                showarrow=False)
-        scat_plot.add_annotation(
-                x=bs.calculate_metrics_at_density(26.5)[1] - 200, y=bs.calculate_metrics_at_density(26.5)[0] - 20,
-                text=f"PSR F",
-                align='left',
-                showarrow=False)
+        # LOS labels: boundary, label, x and y offset from the boundary point
+        for los, label, x_offset, y_offset in [('A', 'PSR A', -350, -10),
+                                               ('B', 'PSR B', -350, -10),
+                                               ('C', 'PSR C', -350, -10),
+                                               ('D', 'PSR D', -350, -5),
+                                               ('E', 'PSR E', -200, 0),
+                                               ('E', 'PSR F', -200, -20)]:
+            crit_speed, crit_flow = critical_flows[los]
+            scat_plot.add_annotation(
+                    x=crit_flow + x_offset, y=crit_speed + y_offset,
+                    text=label,
+                    align='left',
+                    showarrow=False)
         st.plotly_chart(scat_plot)
 
         ### table with critical densities
         st.markdown('###### Tablica natężeń krytycznych dla analizowanego odcinka [E/h/pas]')
     
         df_crit_flow = pd.DataFrame(
-            {
-            "PSR A": [round(bs.calculate_metrics_at_density(6.5)[1])],
-            "PSR B": [round(bs.calculate_metrics_at_density(11)[1])],
-            "PSR C": [round(bs.calculate_metrics_at_density(16)[1])],
-            "PSR D": [round(bs.calculate_metrics_at_density(21)[1])],
-            "PSR E": [round(bs.calculate_metrics_at_density(26.5)[1])],
-            }
+            {f"PSR {los}": [round(critical_flows[los][1])] for los in ['A', 'B', 'C', 'D', 'E']}
         )
         st.dataframe(df_crit_flow, hide_index=True)
     else:
@@ -325,4 +306,7 @@ with col[1]:
                      zawężenia przekroju lub innych przyczyn obniżających przepustowość (tzw. lokalne ograniczenie przepustowości).
             ''')
             st.image(Path(__file__).parent.parent / 'files' / 'congested_traffic.png')
-    
\ No newline at end of file
+    
+if debug:
+    with st.expander("Panel diagnostyczny", expanded=True):
+        st.json(debug_stats.to_dict())
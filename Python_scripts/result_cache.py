@@ -0,0 +1,250 @@
+"""
+Persistent cache of section results in a local SQLite file, for repeated runs over mostly unchanged sections.
+
+Example:
+    cache = ResultCache('results_cache.sqlite', max_entries=2_000_000)
+    result = cache.evaluate(dict(road_class='S', access_points=0.5, speed_limit=100, area_type=1, adt=40000,
+                                 hv_share=0.1, profile='DASS', lanes=2))
+    results = evaluate_cached(df, cache)       # only sections missing in the cache are calculated
+    results = evaluate_cached(df, cache, engine='reference')   # misses calculated with BasicSection methods
+    cache.stats()                              # {'hits': ..., 'misses': ..., 'hit_rate': ..., 'entries': ...}
+
+The key of a section is sha256 of its nine inputs in canonical form (numbers as floats, fixed order) and of the
+fingerprint of the csv tables, so results calculated with other tables are never returned; they are removed when
+the cache is opened with changed tables. The fingerprint is the one of the tables used by the process
+(Tables.fingerprint), i.e. of the csv bytes the results were calculated with.
+The database is in WAL mode and reads do not write, so many processes can read it at the same time while one of them
+writes. When the cache has more than max_entries results, the least recently used are removed; the time of last use
+is updated at most once per TOUCH_INTERVAL, in the next write.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from backend import BasicSection, SectionResult
+from batch import COLUMNS, evaluate_batch
+from compiled_tables import evaluate_compiled_or_batch
+from table_registry import get_tables
+
+# numeric inputs are hashed as floats, so e.g. lanes=2 and lanes=2.0 have the same key
+NUMERIC_INPUTS = ('access_points', 'speed_limit', 'area_type', 'adt', 'hv_share', 'lanes', 'gradient')
+# number of keys in one SELECT ... IN query
+QUERY_SIZE = 500
+# last use of a hit result is recorded only if it is older than this [s]; such updates are buffered and written
+# together with new results (or on close), so reads never take the write lock
+TOUCH_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL, last_used REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def _digest(fingerprint, road_class, profile, numbers):
+    canonical = '|'.join([fingerprint, str(road_class), str(profile)] + [repr(float(value)) for value in numbers])
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def section_key(inputs, fingerprint):
+    """
+    Returns sha256 hex digest of section inputs (dict with BasicSection arguments, gradient 0 by default)
+    and tables fingerprint.
+    """
+    return _digest(fingerprint, inputs['road_class'], inputs['profile'],
+                   [inputs.get(name, 0) for name in NUMERIC_INPUTS])
+
+
+def section_keys(sections, fingerprint):
+    """
+    Returns list of keys of sections given as data frame or dict of arrays (the same as section_key of each row).
+    """
+    size = len(sections['road_class'])
+    numbers = [np.asarray(sections[name]).tolist() if name in sections else [0] * size for name in NUMERIC_INPUTS]
+    return [_digest(fingerprint, road_class, profile, values)
+            for road_class, profile, *values in zip(np.asarray(sections['road_class']).tolist(),
+                                                    np.asarray(sections['profile']).tolist(), *numbers)]
+
+
+class ResultCache:
+    """
+    SQLite cache of SectionResult of sections, shared by processes through the file.
+    """
+    def __init__(self, path, max_entries=1_000_000, timeout=30):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.fingerprint = get_tables().fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+        self.connection = sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            row = self.connection.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+            if row is None or row[0] != self.fingerprint:
+                # results of other tables can't be hit anymore
+                self.connection.execute('DELETE FROM results')
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (self.fingerprint,))
+            self._evict()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def key(self, inputs):
+        return section_key(inputs, self.fingerprint)
+
+    def get_many(self, keys):
+        """
+        Returns list of SectionResult (None for keys missing in the cache). Reads only; use of found results
+        is recorded in memory and written by the next put_many (or flush).
+        """
+        found = {}
+        now = time.time()
+        unique = list(dict.fromkeys(keys))
+        for i in range(0, len(unique), QUERY_SIZE):
+            part = unique[i:i + QUERY_SIZE]
+            query = f"SELECT key, result, last_used FROM results WHERE key IN ({','.join('?' * len(part))})"
+            for key, result, last_used in self.connection.execute(query, part):
+                found[key] = SectionResult(*json.loads(result))
+                if now - last_used > TOUCH_INTERVAL:
+                    self._touched[key] = now
+        results = [found.get(key) for key in keys]
+        self.hits += len(keys) - results.count(None)
+        self.misses += results.count(None)
+        return results
+
+    def put_many(self, keys, results):
+        """
+        Stores SectionResult of keys and removes the least recently used results above max_entries.
+        """
+        now = time.time()
+        rows = [(key, json.dumps(list(result)), now) for key, result in zip(keys, results)]
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self._write_touched()
+            self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', rows)
+            self._evict()
+
+    def flush(self):
+        """
+        Writes buffered times of last use of hit results.
+        """
+        if self._touched:
+            with self.connection:
+                self.connection.execute('BEGIN IMMEDIATE')
+                self._write_touched()
+
+    def _write_touched(self):
+        # in an open transaction
+        self.connection.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                    [(used, key) for key, used in self._touched.items()])
+        self._touched.clear()
+
+    def _evict(self):
+        # removes the least recently used results above max_entries (in an open transaction)
+        excess = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.connection.execute('DELETE FROM results WHERE key IN '
+                                    '(SELECT key FROM results ORDER BY last_used LIMIT ?)', (excess,))
+
+    def evaluate(self, inputs):
+        """
+        Returns SectionResult of section inputs (dict with BasicSection arguments), from the cache or calculated.
+        """
+        key = self.key(inputs)
+        result = self.get_many([key])[0]
+        if result is None:
+            result = BasicSection(**inputs).evaluate()
+            self.put_many([key], [result])
+        return result
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute('DELETE FROM results')
+        self._touched.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns hits and misses of this cache object, hit rate and number of results in the file.
+        """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0],
+                'max_entries': self.max_entries}
+
+
+def _batch_results(sections, evaluate=evaluate_batch):
+    # SectionResult of each section calculated with the vectorized engine
+    results = evaluate(sections)
+    tables = get_tables()
+    rows = []
+    names = np.asarray(sections['road_class']).astype(str).tolist()
+    for i, values in enumerate(zip(*(results[name].tolist() for name in
+                                     ('ffs', 'u50', 'hourly_volume', 'k15', 'ew', 'flow', 'base_capacity',
+                                      'real_capacity', 'utilization', 'avg_speed', 'density', 'los')))):
+        ffs, u50, hourly_volume, k15, ew, flow, base_capacity, real_capacity, utilization, avg_speed, density, los = values
+        capacity = tables.lookup_capacity(names[i], ffs)
+        rows.append(SectionResult(ffs, u50, hourly_volume, k15, ew, flow, base_capacity, real_capacity, utilization,
+                                  capacity.opt_speed, capacity.jam_density, utilization > 1, avg_speed, density, los))
+    return rows
+
+
+def _reference_results(sections):
+    # SectionResult of each section calculated with BasicSection methods
+    names = [name for name in COLUMNS if name in sections]
+    return [BasicSection(**dict(zip(names, values))).evaluate()
+            for values in zip(*(np.asarray(sections[name]).tolist() for name in names))]
+
+
+def _compiled_results(sections):
+    # SectionResult of each section calculated with compiled tables (vectorized engine if they can't be used)
+    return _batch_results(sections, evaluate_compiled_or_batch)
+
+
+# engine -> function calculating SectionResult of sections missing in the cache
+ENGINES = {'batch': _batch_results, 'compiled': _compiled_results, 'reference': _reference_results}
+
+
+def evaluate_cached(sections, cache, engine='batch'):
+    """
+    Calculates sections (data frame or dict of arrays with batch.COLUMNS) using the cache: only sections
+    missing in the cache are calculated (with the engine from ENGINES) and stored.
+    Returns dict of lists with SectionResult fields.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine should be one of: {', '.join(ENGINES)}")
+    columns = {name: np.asarray(sections[name]) for name in COLUMNS if name in sections}
+    keys = section_keys(columns, cache.fingerprint)
+    results = cache.get_many(keys)
+
+    # each missing key is calculated once, also when the same section is repeated
+    missing = {}
+    for i, (key, result) in enumerate(zip(keys, results)):
+        if result is None:
+            missing.setdefault(key, i)
+    if missing:
+        rows = list(missing.values())
+        calculated = dict(zip(missing, ENGINES[engine]({name: values[rows] for name, values in columns.items()})))
+        cache.put_many(list(calculated), list(calculated.values()))
+        results = [calculated[key] if result is None else result for key, result in zip(keys, results)]
+    else:
+        cache.flush()
+    return {name: [getattr(result, name) for result in results] for name in SectionResult._fields}
@@ -0,0 +1,141 @@
+"""
+Columnar output of results: record batches streamed to an Arrow IPC file or to Parquet, with compact types.
+
+Example:
+    with ResultWriter('results.arrow', precision='compact') as writer:        # or results.parquet
+        for chunk in chunks:
+            writer.write(evaluate_chunk('batch', chunk))
+    table = read_results('results.arrow', columns=['los', 'density'])   # memory-mapped, without copying
+    df = table.to_pandas()                                              # LOS as pandas categorical
+
+With precision='compact' result columns are stored in the smallest types which keep values of the method:
+values rounded to 2 decimals (k15, Ew, utilization, speed), 1 decimal (density) or given in tables with at most
+3 decimals (u50) as float32, free-flow speed and base capacity as int16, volumes and capacities as int32.
+Rounding float32 values again to the same decimals gives exactly the calculated values. precision='full' keeps float64 and int64.
+In both modes LOS is dictionary-encoded (int8 indices into the LOS labels), the same dictionary for all batches.
+Values which do not fit the compact type raise pyarrow.ArrowInvalid instead of being truncated.
+"""
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from table_registry import get_tables
+
+# result column -> type with precision='compact'
+COMPACT_TYPES = {
+    'ffs': pa.int16(),
+    'u50': pa.float32(),
+    'hourly_volume': pa.int32(),
+    'k15': pa.float32(),
+    'ew': pa.float32(),
+    'flow': pa.int32(),
+    'base_capacity': pa.int16(),
+    'real_capacity': pa.int32(),
+    'utilization': pa.float32(),
+    'opt_speed': pa.float32(),
+    'jam_density': pa.float32(),
+    'avg_speed': pa.float32(),
+    'density': pa.float32(),
+}
+PRECISIONS = ('compact', 'full')
+FORMATS = {'.arrow': 'arrow', '.ipc': 'arrow', '.feather': 'arrow', '.parquet': 'parquet'}
+
+
+def output_format(path):
+    """
+    Returns 'arrow' or 'parquet' from the file extension.
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix not in FORMATS:
+        raise ValueError(f"Unknown format of {path}, use one of: {', '.join(FORMATS)}")
+    return FORMATS[suffix]
+
+
+def los_array(values, labels):
+    """
+    Returns LOS labels as dictionary array with int8 indices into labels.
+    """
+    values = np.asarray(values).astype(str)
+    names = np.array(labels)
+    order = np.argsort(names)
+    indices = order[np.minimum(np.searchsorted(names, values, sorter=order), len(names) - 1)]
+    unknown = names[indices] != values
+    if unknown.any():
+        raise ValueError(f"Unknown LOS: {sorted(set(values[unknown].tolist()))}")
+    return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int8()), pa.array(labels, pa.string()))
+
+
+def to_table(results, precision='compact', labels=None):
+    """
+    Converts results (data frame or dict of arrays) into a pyarrow Table with compact (or full) types
+    of result columns and dictionary-encoded LOS. Other columns (e.g. inputs, section id) keep their types.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision should be one of: {', '.join(PRECISIONS)}")
+    if hasattr(results, 'columns'):
+        table = pa.Table.from_pandas(results, preserve_index=False)
+    else:
+        table = pa.table({name: np.asarray(values) for name, values in results.items()})
+    labels = labels or get_tables().los_labels
+
+    for i, name in enumerate(table.column_names):
+        if name == 'los':
+            column = los_array(table.column(i).to_numpy(zero_copy_only=False), labels)
+        elif precision == 'compact' and name in COMPACT_TYPES:
+            column = table.column(i).cast(COMPACT_TYPES[name])
+        else:
+            continue
+        table = table.set_column(i, name, column)
+    return table
+
+
+class ResultWriter:
+    """
+    Streams results to an Arrow IPC file or Parquet (format from the extension by default). The schema is set by
+    the first written batch; next batches are cast to it.
+    """
+    def __init__(self, path, file_format=None, precision='compact', compression='zstd'):
+        self.path = str(path)
+        self.format = file_format or output_format(path)
+        self.precision = precision
+        self.compression = compression
+        self.labels = get_tables().los_labels
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, results):
+        table = to_table(results, self.precision, self.labels)
+        if self.writer is None:
+            self.schema = table.schema
+            if self.format == 'arrow':
+                self.writer = pa.ipc.new_file(self.path, table.schema)
+            else:
+                self.writer = pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        elif table.schema != self.schema:
+            table = table.cast(self.schema)
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_results(path, columns=None):
+    """
+    Returns pyarrow Table of results. Arrow IPC files are memory-mapped and the table uses the mapped
+    buffers without copying (uncompressed files only); Parquet files are decoded.
+    """
+    if output_format(path) == 'arrow':
+        table = pa.ipc.open_file(pa.memory_map(str(path), 'r')).read_all()
+        return table.select(columns) if columns else table
+    return pq.read_table(path, columns=columns, memory_map=True)
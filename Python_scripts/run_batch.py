@@ -0,0 +1,199 @@
+"""
+Command-line batch calculations for road sections from a csv file.
+
+Example:
+    python run_batch.py sections.csv results.csv --workers 4 --chunksize 20000
+    python run_batch.py sections.csv results.csv --workers 4 --engine compiled
+    python run_batch.py sections.csv results.csv --cache results_cache.sqlite
+    python run_batch.py sections.csv results.arrow --precision compact
+
+The input csv needs BasicSection columns (road_class, access_points, speed_limit, area_type,
+adt, hv_share, profile, lanes and optionally gradient); other columns (e.g. section id) are
+copied to the output. The file is read in chunks, chunks are calculated in worker processes
+and written to the output (csv, parquet or Arrow IPC) in input order as soon as they are finished.
+With --engine compiled, each worker maps the compiled tables (see compiled_tables.py) when it starts; if they
+are missing or out of date, a warning is printed and the vectorized engine is used.
+With --cache, results are kept in a SQLite file (see result_cache.py) and sections found there
+are not calculated again; missing sections are calculated with the chosen engine. Hits and misses of all
+workers are reported at the end.
+"""
+import argparse
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from backend import BasicSection
+from batch import COLUMNS, evaluate_batch
+from compiled_tables import evaluate_compiled_or_batch, get_compiled
+
+RESULT_COLUMNS = ('ffs', 'u50', 'hourly_volume', 'k15', 'ew', 'flow', 'base_capacity', 'real_capacity',
+                  'utilization', 'avg_speed', 'density', 'los')
+
+
+def evaluate_reference(chunk):
+    """
+    Calculates results row by row with BasicSection methods (reference for the vectorized engine).
+    """
+    results = {column: [] for column in RESULT_COLUMNS}
+    columns = [column for column in COLUMNS if column in chunk.columns]
+    for row in chunk[columns].itertuples(index=False):
+        result = BasicSection(**row._asdict()).evaluate()
+        for column in RESULT_COLUMNS:
+            results[column].append(getattr(result, column))
+    return results
+
+
+ENGINES = {'batch': evaluate_batch, 'compiled': evaluate_compiled_or_batch, 'reference': evaluate_reference}
+
+
+def _init_worker(engine):
+    # compiled tables mapped once per worker process
+    if engine == 'compiled':
+        get_compiled()
+
+
+# result caches opened in this process, by path
+_caches = {}
+
+
+def evaluate_chunk(engine, chunk, cache_path=None):
+    return evaluate_chunk_cached(engine, chunk, cache_path)[0]
+
+
+def evaluate_chunk_cached(engine, chunk, cache_path=None):
+    """
+    Returns results of the chunk and numbers of cache hits and misses of it (0 and 0 without cache).
+    """
+    hits = misses = 0
+    if cache_path:
+        from result_cache import ResultCache, evaluate_cached
+        if cache_path not in _caches:
+            _caches[cache_path] = ResultCache(cache_path)
+        cache = _caches[cache_path]
+        hits, misses = cache.hits, cache.misses
+        results = evaluate_cached(chunk, cache, engine)
+        hits, misses = cache.hits - hits, cache.misses - misses
+    else:
+        results = ENGINES[engine](chunk)
+    output = chunk.reset_index(drop=True)
+    for column in RESULT_COLUMNS:
+        output[column] = results[column]
+    return output, hits, misses
+
+
+def cache_stats(cache_path, hits, misses):
+    """
+    Returns ResultCache.stats() with hits and misses of all workers.
+    """
+    from result_cache import ResultCache
+    with ResultCache(cache_path) as cache:
+        cache.hits, cache.misses = hits, misses
+        return cache.stats()
+
+
+class CsvOutput:
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+
+def open_output(path, output_format=None, precision='full'):
+    """
+    Returns writer of results: csv, or parquet / arrow (Arrow IPC) with result_writer.ResultWriter.
+    """
+    output_format = output_format or {'.parquet': 'parquet', '.arrow': 'arrow'}.get(Path(path).suffix.lower(), 'csv')
+    if output_format == 'csv':
+        return CsvOutput(path)
+    try:
+        from result_writer import ResultWriter
+    except ImportError:
+        sys.exit("Parquet and Arrow output requires pyarrow (pip install pyarrow).")
+    return ResultWriter(path, output_format, precision=precision)
+
+
+def run(input_path, output_path, workers=1, chunksize=10000, engine='batch', output_format=None, quiet=False,
+        cache_path=None, precision='full', stats=None):
+    """
+    Calculates all sections from input csv and writes results. At most 2 * workers chunks are
+    kept in memory at the same time. Returns number of sections.
+    With cache_path, stats (dict) gets cache hits and misses of all chunks.
+    """
+    output = open_output(output_path, output_format, precision)
+    chunks = pd.read_csv(input_path, chunksize=chunksize)
+    start = time.perf_counter()
+    sections = 0
+    stats = {} if stats is None else stats
+    stats.update(hits=0, misses=0)
+
+    def report(result):
+        nonlocal sections
+        df, hits, misses = result
+        stats['hits'] += hits
+        stats['misses'] += misses
+        output.write(df)
+        sections += len(df)
+        if not quiet:
+            elapsed = time.perf_counter() - start
+            print(f"{sections} sections, {elapsed:.1f} s, {sections / elapsed:.0f} sections/s", file=sys.stderr)
+
+    try:
+        if workers <= 1:
+            _init_worker(engine)
+            for chunk in chunks:
+                report(evaluate_chunk_cached(engine, chunk, cache_path))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(evaluate_chunk_cached, engine, chunk, cache_path))
+                    if len(pending) >= 2 * workers:
+                        report(pending.popleft().result())
+                while pending:
+                    report(pending.popleft().result())
+    finally:
+        output.close()
+    return sections
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Traffic conditions assessment for road sections from csv file.")
+    parser.add_argument('input', help="csv file with sections")
+    parser.add_argument('output', help="output file (.csv or .parquet)")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--chunksize', type=int, default=10000, help="number of sections in one chunk")
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='batch',
+                        help="'batch' - vectorized engine, 'compiled' - vectorized engine with compiled tables, "
+                             "'reference' - BasicSection methods row by row")
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], help="output format (by default from file extension)")
+    parser.add_argument('--precision', choices=['full', 'compact'], default='full',
+                        help="types of results in parquet/arrow: 'compact' - float32 and int16/int32 (see result_writer.py)")
+    parser.add_argument('--quiet', action='store_true', help="do not report progress")
+    parser.add_argument('--cache', metavar='PATH', help="SQLite file with results of previous runs")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = {}
+    sections = run(args.input, args.output, workers=args.workers, chunksize=args.chunksize,
+                   engine=args.engine, output_format=args.format, quiet=args.quiet, cache_path=args.cache,
+                   precision=args.precision, stats=stats)
+    elapsed = time.perf_counter() - start
+    print(f"Done: {sections} sections in {elapsed:.1f} s ({sections / max(elapsed, 1e-9):.0f} sections/s)", file=sys.stderr)
+    if args.cache:
+        stats = cache_stats(args.cache, stats['hits'], stats['misses'])
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+              f"{stats['entries']} of {stats['max_entries']} entries", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+BasicSection calculations as an explicit dependency graph, for interactive what-if editing.
+
+Example:
+    graph = SectionGraph(road_class='S', access_points=0.5, speed_limit=100, area_type=1, adt=40000,
+                         hv_share=0.1, profile='DASS', lanes=2)
+    graph.evaluate()
+    graph.update(hv_share=0.2)      # returns recalculated nodes: Ew, flow, utilization, speed, density, LOS...
+    graph.assess()                  # SectionAssessment, FFS, curve and critical flows are not calculated again
+
+Nodes are memoized BasicSection methods and DEPENDENCIES lists inputs and nodes used by each of them:
+    inputs -> FFS -> capacity, optimal speed, jam density, Van Aerde curve -> critical flows
+    ADT, profile -> u50 -> hourly volume -> k15
+    road class, lanes, gradient, HV share -> Ew -> flow -> utilization -> speed -> density -> LOS
+When inputs are edited, nodes depending on them are calculated again in dependency order; if a node gets
+the same value as before (e.g. FFS after a small change of access points), nodes depending only on it are kept.
+"""
+from collections import Counter
+
+from backend import BasicSection, PLOT_POINTS, build_assessment
+from table_registry import get_tables
+
+DEPENDENCIES = {
+    'calculate_ffs': ('road_class', 'access_points', 'speed_limit', 'area_type'),
+    'define_u50': ('profile', 'adt'),
+    'calculate_hourly_volume': ('adt', 'define_u50'),
+    'calculate_k15': ('area_type', 'lanes', 'calculate_hourly_volume'),
+    'estimate_base_capacity': ('road_class', 'calculate_ffs'),
+    'calculate_ew': ('road_class', 'lanes', 'gradient', 'hv_share'),
+    'select_ew': ('lanes', 'calculate_hourly_volume', 'calculate_k15', 'calculate_ew', 'estimate_base_capacity'),
+    'calculate_flow': ('lanes', 'calculate_hourly_volume', 'calculate_k15', 'select_ew'),
+    'calculate_real_capacity': ('lanes', 'estimate_base_capacity', 'calculate_k15', 'calculate_ew'),
+    'calculate_utilization': ('calculate_flow', 'estimate_base_capacity'),
+    'calculate_opt_speed': ('road_class', 'calculate_ffs'),
+    'calculate_jam_density': ('road_class', 'calculate_ffs'),
+    'van_aerde_model': ('estimate_base_capacity', 'calculate_opt_speed', 'calculate_ffs', 'calculate_jam_density'),
+    'van_aerde_curve': ('road_class', 'calculate_ffs'),
+    'calculate_avg_speed': ('solver', 'calculate_utilization', 'calculate_flow', 'van_aerde_model', 'van_aerde_curve'),
+    'calculate_density': ('calculate_avg_speed', 'calculate_flow'),
+    'assess_los': ('calculate_density',),
+    'evaluate': ('calculate_ffs', 'define_u50', 'calculate_hourly_volume', 'calculate_k15', 'select_ew',
+                 'calculate_flow', 'estimate_base_capacity', 'calculate_real_capacity', 'calculate_utilization',
+                 'calculate_opt_speed', 'calculate_jam_density', 'calculate_avg_speed', 'calculate_density',
+                 'assess_los'),
+    'calculate_metrics_at_density': ('solver', 'van_aerde_model', 'van_aerde_curve'),
+    'calculate_critical_flows': ('solver', 'van_aerde_curve', 'calculate_metrics_at_density'),
+}
+
+INPUTS = BasicSection.INPUTS + ('solver',)
+
+
+def _dependents(dependencies):
+    # node or input -> nodes using it directly
+    dependents = {}
+    for node, used in dependencies.items():
+        for name in used:
+            dependents.setdefault(name, []).append(node)
+    return dependents
+
+
+def _topological_order(dependencies):
+    order, visited = [], set()
+
+    def visit(node):
+        if node in visited or node not in dependencies:
+            return
+        visited.add(node)
+        for name in dependencies[node]:
+            visit(name)
+        order.append(node)
+
+    for node in dependencies:
+        visit(node)
+    return order
+
+
+DEPENDENTS = _dependents(DEPENDENCIES)
+ORDER = _topological_order(DEPENDENCIES)
+
+
+def affected_nodes(changed):
+    """
+    Returns set of nodes depending (directly or not) on changed inputs or nodes.
+    """
+    affected, stack = set(), list(changed)
+    while stack:
+        for node in DEPENDENTS.get(stack.pop(), ()):
+            if node not in affected:
+                affected.add(node)
+                stack.append(node)
+    return affected
+
+
+class SectionGraph:
+    """
+    BasicSection held between edits; update() recalculates only the values invalidated by changed inputs.
+    recalculated counts calculations of each node by update().
+    """
+    def __init__(self, solver='grid', input_hourly_volume=None, **inputs):
+        self.section = BasicSection(solver=solver, **self._volume_inputs(inputs, input_hourly_volume))
+        self.input_hourly_volume = input_hourly_volume
+        self.recalculated = Counter()
+
+    def _volume_inputs(self, inputs, input_hourly_volume):
+        # ADT calculated from hourly volume with u50 factor of the given ADT, as in backend.assess_section
+        if input_hourly_volume is None:
+            return inputs
+        section = self.__dict__.get('section')
+        profile = inputs['profile'] if 'profile' in inputs else section.profile
+        adt = inputs['adt'] if 'adt' in inputs else section.adt
+        u50 = (section.tables if section else get_tables()).lookup_u50(profile, adt)
+        return {**inputs, 'adt': int(input_hourly_volume * 2 / u50)}
+
+    def __getattr__(self, name):
+        # inputs and methods of the section, e.g. graph.adt or graph.calculate_flow()
+        if name == 'section':
+            raise AttributeError(name)
+        return getattr(self.section, name)
+
+    def update(self, input_hourly_volume=None, **inputs):
+        """
+        Sets new values of inputs (e.g. hv_share=0.2) and calculates again values depending on them which
+        were already calculated. Returns list of recalculated nodes in dependency order.
+        If input_hourly_volume is given, ADT is calculated from it and u50 factor of the given (or current) ADT.
+        """
+        unknown = set(inputs) - set(INPUTS)
+        if unknown:
+            raise TypeError(f"Unknown inputs: {', '.join(sorted(unknown))}")
+        inputs = self._volume_inputs(inputs, input_hourly_volume)
+        self.input_hourly_volume = input_hourly_volume
+        section = self.section
+        changed = [name for name, value in inputs.items() if getattr(section, name) != value]
+        if not changed:
+            return []
+        for name in changed:
+            # object.__setattr__ does not clear the whole cache of the section
+            object.__setattr__(section, name, inputs[name])
+
+        cache = section._cache
+        dirty = set()
+        for name in changed:
+            dirty.update(DEPENDENTS.get(name, ()))
+        affected = affected_nodes(changed)
+        recalculated = []
+        try:
+            for node in ORDER:
+                if node not in dirty:
+                    continue
+                keys = [key for key in cache if key[0] == node]
+                for key in keys:
+                    previous = cache.pop(key)
+                    value = getattr(section, node)(*key[1], **dict(key[2] if len(key) > 2 else ()))
+                    self.recalculated[node] += 1
+                    recalculated.append(node)
+                    if value is not previous and not _same(value, previous):
+                        dirty.update(DEPENDENTS.get(node, ()))
+                if not keys:
+                    # value was not calculated before, so nodes using it are not calculated either
+                    dirty.update(DEPENDENTS.get(node, ()))
+        except Exception:
+            # values which were not recalculated can't be trusted anymore
+            for key in [key for key in cache if key[0] in affected and key[0] not in recalculated]:
+                del cache[key]
+            raise
+        return recalculated
+
+    def evaluate(self):
+        return self.section.evaluate()
+
+    def assess(self, plot_points=PLOT_POINTS):
+        """
+        Returns SectionAssessment of the current inputs, as backend.assess_section
+        (with input hourly volume of the last update, if it was given).
+        """
+        if self.input_hourly_volume is not None:
+            hourly_volume = self.input_hourly_volume
+        else:
+            hourly_volume = self.section.calculate_hourly_volume()
+        return build_assessment(self.section, hourly_volume, plot_points)
+
+
+def _same(value, previous):
+    # equal values, NaN (e.g. density of congested traffic in SectionResult) equal to NaN
+    try:
+        return value == previous or value != value and previous != previous
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,153 @@
+"""
+Scenario sweeps: Cartesian product of input values (and forecast years) calculated in chunks.
+
+Example:
+    summary = run_sweep(
+        base={'road_class': 'S', 'access_points': 0.5, 'area_type': 1, 'profile': 'DASM'},
+        grid={'adt': range(20000, 100001, 5000), 'lanes': [2, 3, 4], 'speed_limit': [100, 120],
+              'gradient': [0, 0.03, 0.05], 'hv_share': [0.1, 0.2, 0.3], 'year': [2025, 2030, 2035],
+              'growth_rate': [0.01, 0.03]},
+        base_year=2025, output='sweep.parquet', summary_by=('base_adt', 'lanes'))
+    los_heatmap(summary)
+
+The grid is enumerated lazily with itertools.product and only one chunk per worker (at most 2 * workers)
+is kept in memory, so the size of the grid is not limited by RAM. Results are written to csv or parquet
+as chunks are finished, and LOS counts for summary_by columns are accumulated on the way.
+If the grid has 'year' (and optionally 'growth_rate', 0 by default), ADT of the grid is the ADT of
+base_year and ADT of the scenario is ADT * (1 + growth_rate) ** (year - base_year); the grid value is kept
+in base_adt column.
+"""
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, product
+from math import prod
+
+import numpy as np
+import pandas as pd
+
+from batch import COLUMNS, evaluate_batch
+from run_batch import RESULT_COLUMNS, open_output
+from table_registry import get_tables
+
+
+def grid_size(grid):
+    return prod(len(values) for values in grid.values())
+
+
+def scenario_chunks(base, grid, chunksize=50000, base_year=None):
+    """
+    Yields data frames with chunksize scenarios of the grid, the last column of the grid changes fastest.
+    """
+    names = list(grid)
+    combinations = product(*(list(values) for values in grid.values()))
+    while True:
+        rows = list(islice(combinations, chunksize))
+        if not rows:
+            return
+        chunk = pd.DataFrame(rows, columns=names)
+        for name, value in base.items():
+            if name not in chunk:
+                chunk[name] = value
+        if 'year' in chunk:
+            if base_year is None:
+                raise ValueError("base_year is required for grid with year")
+            growth_rate = chunk['growth_rate'] if 'growth_rate' in chunk else 0.0
+            chunk['base_adt'] = chunk['adt']
+            chunk['adt'] = np.trunc(chunk['adt'] * (1 + growth_rate) ** (chunk['year'] - base_year)).astype(np.int64)
+        yield chunk
+
+
+def evaluate_scenarios(chunk):
+    """
+    Calculates a chunk of scenarios with the vectorized engine. Returns data frame with inputs and results.
+    """
+    results = evaluate_batch({name: chunk[name].to_numpy() for name in COLUMNS if name in chunk})
+    output = chunk.reset_index(drop=True)
+    for column in RESULT_COLUMNS:
+        output[column] = results[column]
+    return output
+
+
+class LosCounts:
+    """
+    Number of scenarios in each LOS for combinations of values of summary_by columns, accumulated chunk by chunk.
+    """
+    def __init__(self, summary_by):
+        self.summary_by = list(summary_by)
+        self.labels = list(get_tables().los_labels)
+        self.counts = None
+
+    def add(self, results):
+        counts = results.groupby(self.summary_by + ['los']).size().unstack('los', fill_value=0)
+        counts = counts.reindex(columns=self.labels, fill_value=0)
+        self.counts = counts if self.counts is None else self.counts.add(counts, fill_value=0).astype(np.int64)
+
+    def result(self):
+        if self.counts is None:
+            return pd.DataFrame(columns=self.labels)
+        counts = self.counts.sort_index()
+        counts.columns.name = None
+        return counts
+
+
+def run_sweep(base, grid, output=None, output_format=None, summary_by=('adt', 'lanes'), chunksize=50000, workers=1,
+              base_year=None, quiet=True, precision='full'):
+    """
+    Calculates all scenarios of the grid (dict of input -> values) with fixed base inputs. Results are written
+    to output file (csv, parquet or arrow, with precision 'full' or 'compact', see result_writer.py) if given.
+    Returns data frame with number of scenarios in each LOS (columns) for summary_by columns (index).
+    """
+    writer = open_output(output, output_format, precision) if output else None
+    summary = LosCounts(summary_by)
+    total = grid_size(grid)
+    chunks = scenario_chunks(base, grid, chunksize, base_year)
+    start = time.perf_counter()
+    done = 0
+
+    def report(results):
+        nonlocal done
+        if writer:
+            writer.write(results)
+        summary.add(results)
+        done += len(results)
+        if not quiet:
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{total} scenarios, {elapsed:.1f} s, {done / elapsed:.0f} scenarios/s", file=sys.stderr)
+
+    try:
+        if workers <= 1:
+            for chunk in chunks:
+                report(evaluate_scenarios(chunk))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(evaluate_scenarios, chunk))
+                    if len(pending) >= 2 * workers:
+                        report(pending.popleft().result())
+                while pending:
+                    report(pending.popleft().result())
+    finally:
+        if writer:
+            writer.close()
+    return summary.result()
+
+
+def los_heatmap(summary, index=None, columns=None, worse_than=None):
+    """
+    Pivots summary of run_sweep (with two summary_by columns) into a table for a heatmap:
+    the most frequent LOS of scenarios in each cell, or, if worse_than is given (e.g. 'D'),
+    the share of scenarios with LOS worse than it.
+    """
+    index = index or summary.index.names[0]
+    columns = columns or summary.index.names[1]
+    counts = summary.groupby([index, columns]).sum()
+    if worse_than is None:
+        cells = counts.idxmax(axis=1)
+    else:
+        labels = list(counts.columns)
+        worse = labels[labels.index(worse_than) + 1:]
+        cells = counts[worse].sum(axis=1) / counts.sum(axis=1)
+    return cells.unstack(columns)
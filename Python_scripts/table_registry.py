@@ -0,0 +1,198 @@
+import csv
+import hashlib
+import io
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from pathlib import Path
+from types import MappingProxyType
+
+import numpy as np
+
+TABLES_DIR = Path(__file__).parent / 'data_tables'
+
+SOURCE_FILES = ('u50.csv', 'ew_rate.csv', 'psr_bound.csv', 'capacity.csv')
+
+CapacityRow = namedtuple('CapacityRow', ['base_capacity', 'opt_speed', 'jam_density'])
+
+
+class Tables:
+    """
+    Method tables with lookup structures compiled at load time.
+    Rows are parsed with the csv module, so loading tables does not import pandas; data frames of the
+    tables (u50_table, ew_table, los_table, capacity_table) are read on first access and have to be
+    treated as read-only.
+    """
+    def __init__(self, u50_rows, ew_rows, los_rows, capacity_rows, directory=TABLES_DIR, fingerprint=None, sources=None):
+        self.directory = Path(directory)
+        # sha256 of the csv bytes the tables were parsed from (see _read_tables)
+        self.fingerprint = fingerprint
+        self._sources = sources or {}
+        self._frames = {}
+
+        # (road_class, ffs) -> base capacity, optimal speed and jam density
+        self._capacity = MappingProxyType({
+            (row['road_class'], int(row['ffs'])): CapacityRow(int(row['base_capacity']), float(row['opt_speed']),
+                                                              float(row['jam_density']))
+            for row in capacity_rows
+        })
+
+        # light vehicles: max_gradient -> Es, heavy vehicles: (road_class, lanes, max_util_rate, max_gradient) -> Ec
+        self._es = MappingProxyType({float(row['max_gradient']): float(row['conv_factor'])
+                                     for row in ew_rows if row['veh_type'] == 'lv'})
+        self._ec = MappingProxyType({
+            (row['road_class'], int(float(row['lanes'])), float(row['max_util_rate']), float(row['max_gradient'])):
+                float(row['conv_factor'])
+            for row in ew_rows if row['veh_type'] == 'hv'
+        })
+
+        # profile -> ADT intervals sorted by ADT_min, searched with bisect
+        u50_index = {}
+        for row in sorted(u50_rows, key=lambda row: int(row['ADT_min'])):
+            adt_min, adt_max, u50 = u50_index.setdefault(row['Profile'], ([], [], []))
+            adt_min.append(int(row['ADT_min']))
+            adt_max.append(int(row['ADT_max']))
+            u50.append(float(row['u50']))
+        self._u50 = MappingProxyType({profile: tuple(tuple(values) for values in intervals)
+                                      for profile, intervals in u50_index.items()})
+
+        # LOS boundaries (upper lane density of LOS), sorted by density
+        los_rows = sorted(los_rows, key=lambda row: float(row['lane_density']))
+        self.los_labels = tuple(row['LOS'] for row in los_rows)
+        self.los_bounds = np.array([float(row['lane_density']) for row in los_rows])
+        self.los_bounds.flags.writeable = False
+        self._los_density = MappingProxyType(dict(zip(self.los_labels, self.los_bounds.tolist())))
+
+    def _frame(self, name):
+        # pandas is imported only when a data frame of a table is requested
+        if name not in self._frames:
+            import pandas as pd
+            source = self._sources.get(f'{name}.csv')
+            self._frames[name] = pd.read_csv(io.BytesIO(source) if source is not None else self.directory / f'{name}.csv')
+        return self._frames[name]
+
+    @property
+    def u50_table(self):
+        return self._frame('u50')
+
+    @property
+    def ew_table(self):
+        return self._frame('ew_rate')
+
+    @property
+    def los_table(self):
+        return self._frame('psr_bound')
+
+    @property
+    def capacity_table(self):
+        return self._frame('capacity')
+
+    def profiles(self):
+        """
+        Returns names of traffic profiles of u50 table.
+        """
+        return tuple(self._u50)
+
+    def lookup_u50(self, profile, adt):
+        """
+        Returns u50 factor for the profile and ADT interval containing adt.
+        """
+        adt_min, adt_max, u50 = self._u50[profile]
+        i = bisect_right(adt_min, adt) - 1
+        if i < 0 or adt > adt_max[i]:
+            raise KeyError(f"ADT {adt} is out of the u50 table range for profile {profile}")
+        return u50[i]
+
+    def u50_intervals(self, profile):
+        """
+        Returns ADT_min, ADT_max and u50 tuples of the profile, sorted by ADT_min.
+        """
+        return self._u50[profile]
+
+    def lookup_capacity(self, road_class, ffs):
+        """
+        Returns capacity table row (base capacity, optimal speed, jam density) for road class and free-flow speed.
+        """
+        return self._capacity[(road_class, ffs)]
+
+    def capacity_keys(self):
+        """
+        Returns (road_class, ffs) pairs of all rows of capacity table.
+        """
+        return tuple(self._capacity)
+
+    def lookup_los_density(self, los):
+        """
+        Returns lane density at the upper boundary of LOS.
+        """
+        return self._los_density[los]
+
+    def lookup_es(self, max_gradient):
+        """
+        Returns light vehicles conversion factor for gradient category.
+        """
+        return self._es[max_gradient]
+
+    def lookup_ec(self, road_class, lanes, max_util_rate, max_gradient):
+        """
+        Returns heavy vehicles conversion factor.
+        """
+        return self._ec[(road_class, lanes, max_util_rate, max_gradient)]
+
+
+_tables = None
+_lock = threading.Lock()
+
+
+def parse_rows(data):
+    """
+    Returns rows of csv file contents (bytes) as list of dicts of strings.
+    """
+    return list(csv.DictReader(io.StringIO(data.decode('utf-8-sig'), newline='')))
+
+
+def _fingerprint(sources):
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        digest.update(name.encode())
+        digest.update(sources[name])
+    return digest.hexdigest()
+
+
+def _read_tables():
+    """
+    Parses csv files from data_tables directory. Each file is read once, and the fingerprint is calculated
+    from the same bytes that are parsed.
+    """
+    sources = {name: (TABLES_DIR / name).read_bytes() for name in SOURCE_FILES}
+    return Tables(
+        u50_rows=parse_rows(sources['u50.csv']),
+        ew_rows=parse_rows(sources['ew_rate.csv']),
+        los_rows=parse_rows(sources['psr_bound.csv']),
+        capacity_rows=parse_rows(sources['capacity.csv']),
+        fingerprint=_fingerprint(sources),
+        sources=sources,
+    )
+
+
+def get_tables():
+    """
+    Returns method tables, parsed from csv files once per process.
+    """
+    global _tables
+    if _tables is None:
+        with _lock:
+            if _tables is None:
+                _tables = _read_tables()
+    return _tables
+
+
+def reload_tables():
+    """
+    Parses csv files again (e.g. after the tables were edited) and replaces shared tables.
+    Sections created before reload keep the previous tables.
+    """
+    global _tables
+    with _lock:
+        _tables = _read_tables()
+    return _tables
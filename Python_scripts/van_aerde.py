@@ -0,0 +1,304 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from table_registry import get_tables
+
+# highest lane density at uninterrupted flow (boundary of LOS E)
+OPT_DENSITY = 26.5
+# number of points of the speed-flow curve on the results chart
+PLOT_POINTS = 300
+# downsampled versions (numbers of points) kept with each curve
+PLOT_CACHE_SIZE = 4
+
+
+class VanAerdeModel:
+    """
+    Van Aerde speed-flow-density model of the section with closed-form inversion.
+    Density at speed v: k = 1 / (c1 + c2 / (ffs - v) + c3 * v), flow: q = v * k.
+    Both relations can be rearranged into quadratic equations in v, so speed at given flow
+    (uncongested branch) or at given density is solved analytically instead of searching
+    the speed grid of BasicSection.van_aerde_calculations.
+    Compared with the grid (speed step 0.01, density and volume rounded to 0.01):
+    - speed at flow differs by less than 0.1 km/h for flows below 99% of capacity (at most 0.083 km/h,
+      class A, FFS 120, flow 2177) and by less than 0.04 km/h below 95% (near capacity the curve is flat
+      and the grid resolves speed only to ~0.3 km/h),
+    - speed at density differs by less than 0.02 km/h and flow at density by less than 1.5%
+      (near free-flow speed the grid density changes by more than 0.01 per speed step).
+    """
+    def __init__(self, capacity, opt_speed, ffs, jam_density):
+        self.capacity = capacity
+        self.opt_speed = opt_speed
+        self.ffs = ffs
+        self.jam_density = jam_density
+
+        # Van Aerde model coefficients
+        m = (2 * opt_speed - ffs) / ((ffs - opt_speed)**2)
+        self.c2 = 1 / (jam_density * (m + 1/ffs))
+        self.c1 = m * self.c2
+        self.c3 = (1/opt_speed) * ((opt_speed/capacity) - self.c1 - self.c2/(ffs - opt_speed))
+
+    def density_at_speed(self, speed):
+        if speed >= self.ffs:
+            return 0.0
+        return 1 / (self.c1 + self.c2/(self.ffs - speed) + self.c3 * speed)
+
+    def flow_at_speed(self, speed):
+        return speed * self.density_at_speed(speed)
+
+    def speed_at_density(self, density):
+        """
+        Returns speed at given lane density. Density above jam density gives speed 0.
+        """
+        if density <= 0:
+            return float(self.ffs)
+        # c3*v^2 - (a + c3*ffs)*v + (a*ffs - c2) = 0, where a = 1/density - c1
+        a = 1/density - self.c1
+        b = a + self.c3 * self.ffs
+        c = a * self.ffs - self.c2
+        if c <= 0:
+            return 0.0
+        # smaller root, written in the form without cancellation
+        return 2 * c / (b + math.sqrt(max(b * b - 4 * self.c3 * c, 0.0)))
+
+    def speed_at_flow(self, flow, max_density=OPT_DENSITY):
+        """
+        Returns speed at given flow on the uncongested branch of the curve.
+        Speed is limited by optimal speed and by speed at max_density, so for flow above the
+        highest flow of that branch the lowest speed of the branch is returned.
+        """
+        min_speed = self.opt_speed
+        if max_density is not None:
+            min_speed = max(min_speed, self.speed_at_density(max_density))
+        if flow <= 0:
+            return float(self.ffs)
+        if flow >= self.flow_at_speed(min_speed):
+            return min_speed
+        # (1 - q*c3)*v^2 + (q*c3*ffs - q*c1 - ffs)*v + q*(c1*ffs + c2) = 0, larger root is uncongested
+        a = 1 - flow * self.c3
+        b = flow * self.c3 * self.ffs - flow * self.c1 - self.ffs
+        c = flow * (self.c1 * self.ffs + self.c2)
+        speed = (-b + math.sqrt(max(b * b - 4 * a * c, 0.0))) / (2 * a)
+        return min(max(speed, min_speed), float(self.ffs))
+
+
+def nearest_index(values, target):
+    """
+    Returns index of the value closest to target. If the closest value occurs more than once, the first one is returned.
+    Ties between different values are resolved with argsort, the same way as in the original data frame search.
+    """
+    differences = np.abs(values - target)
+    i = differences.argmin()
+    if np.count_nonzero(differences == differences[i]) > 1:
+        i = differences.argsort()[0]
+        i = np.flatnonzero(values == values[i])[0]
+    return i
+
+
+class VanAerdeCurve:
+    """
+    Van Aerde model calculated with speed step 0.01 (from free-flow speed to 0), stored as read-only arrays.
+    Values are the same as in BasicSection.van_aerde_calculations df.
+    plot_cache holds points downsampled by plot_points, so they are dropped together with the curve.
+    """
+    ARRAYS = ('speed', 'density', 'volume', 'uncongested_speed', 'uncongested_volume', 'volume_order')
+    __slots__ = ARRAYS + ('plot_cache',)
+
+    def __init__(self, model):
+        ffs = model.ffs
+        self.speed = np.round(np.arange(ffs, -0.01, -0.01), 2)
+        with np.errstate(divide='ignore'):
+            self.density = np.round(1 / (model.c1 + model.c2/(ffs - self.speed) + model.c3 * self.speed), 2)
+        self.volume = np.round(self.speed * self.density, 2)
+
+        # part of the curve up to density at LOS E boundary
+        uncongested = self.density <= OPT_DENSITY
+        self.uncongested_speed = self.speed[uncongested]
+        self.uncongested_volume = self.volume[uncongested]
+        self.volume_order = np.argsort(self.uncongested_volume, kind='stable')
+
+        for name in self.ARRAYS:
+            getattr(self, name).flags.writeable = False
+        self.plot_cache = {}
+
+    @property
+    def nbytes(self):
+        return (sum(getattr(self, name).nbytes for name in self.ARRAYS)
+                + sum(volume.nbytes + speed.nbytes for volume, speed in list(self.plot_cache.values())))
+
+    def speed_at_flow(self, flow):
+        """
+        Returns speed of the uncongested part of the curve at the volume closest to flow.
+        """
+        i = nearest_index(self.uncongested_volume, flow)
+        return float(self.uncongested_speed[i])
+
+    def speeds_at_flows(self, flows):
+        """
+        Vectorized speed_at_flow for an array of flows.
+        """
+        flows = np.asarray(flows, dtype=float)
+        volume = self.uncongested_volume[self.volume_order]
+        last = len(volume) - 1
+
+        # closest smaller and closest greater or equal volume in sorted volumes
+        upper = np.searchsorted(volume, flows, side='left')
+        lower = np.clip(upper - 1, 0, last)
+        upper = np.clip(upper, 0, last)
+        lower_diff = np.abs(volume[lower] - flows)
+        upper_diff = np.abs(volume[upper] - flows)
+        nearest = np.where(lower_diff < upper_diff, lower, upper)
+
+        # first row (highest speed) with the nearest volume
+        nearest = np.searchsorted(volume, volume[nearest], side='left')
+        speeds = self.uncongested_speed[self.volume_order[nearest]]
+
+        # ties between different volumes are resolved as in speed_at_flow
+        ties = (lower_diff == upper_diff) & (volume[lower] != volume[upper])
+        for i in np.flatnonzero(ties):
+            speeds[i] = self.speed_at_flow(flows[i])
+        return speeds
+
+    def metrics_at_density(self, density):
+        """
+        Returns speed and volume of the curve at the density closest to given density.
+        """
+        i = nearest_index(self.density, density)
+        return float(self.speed[i]), float(self.volume[i])
+
+    def metrics_at_densities(self, densities):
+        """
+        Vectorized metrics_at_density, returns arrays of speeds and volumes.
+        Density increases along the curve, so the closest densities are found with one searchsorted.
+        """
+        densities = np.asarray(densities, dtype=float)
+        last = len(self.density) - 1
+
+        upper = np.searchsorted(self.density, densities, side='left')
+        lower = np.clip(upper - 1, 0, last)
+        upper = np.clip(upper, 0, last)
+        lower_diff = np.abs(self.density[lower] - densities)
+        upper_diff = np.abs(self.density[upper] - densities)
+        nearest = np.where(lower_diff < upper_diff, lower, upper)
+        # first row (highest speed) with the nearest density
+        nearest = np.searchsorted(self.density, self.density[nearest], side='left')
+
+        # ties between different densities are resolved as in metrics_at_density
+        ties = (lower_diff == upper_diff) & (self.density[lower] != self.density[upper])
+        for i in np.flatnonzero(ties):
+            nearest[i] = nearest_index(self.density, densities[i])
+        return self.speed[nearest], self.volume[nearest]
+
+
+def lttb(x, y, points):
+    """
+    Downsamples a line to points with Largest-Triangle-Three-Buckets algorithm (keeps the first and the last point
+    and from each bucket the point making the largest triangle with the previous point and the next bucket mean).
+    Returns indices of the selected points.
+    """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+    every = (size - 2) / (points - 2)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    a = 0
+    for i in range(points - 2):
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, size)
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def plot_points(curve, points=PLOT_POINTS):
+    """
+    Returns (volume, speed) arrays of the uncongested part of the curve downsampled with lttb to points.
+    Stored in curve.plot_cache (the last PLOT_CACHE_SIZE numbers of points), so per (road_class, ffs) only as long
+    as the curve is kept in curve_cache.
+    """
+    cached = curve.plot_cache.get(points)
+    if cached is not None:
+        return cached
+    i = lttb(curve.uncongested_volume, curve.uncongested_speed, points)
+    volume = curve.uncongested_volume[i]
+    speed = curve.uncongested_speed[i]
+    volume.flags.writeable = False
+    speed.flags.writeable = False
+    if len(curve.plot_cache) >= PLOT_CACHE_SIZE:
+        curve.plot_cache.pop(next(iter(curve.plot_cache), None), None)
+    curve.plot_cache[points] = volume, speed
+    return volume, speed
+
+
+class CurveCache:
+    """
+    Process-wide LRU cache of Van Aerde curves keyed by (road_class, ffs).
+    There is only one curve for each row of capacity table, so with maxsize of at least
+    the number of rows (103) every curve is calculated once per process.
+    Cached curves are dropped when method tables are reloaded.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._curves = OrderedDict()
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def get(self, road_class, ffs):
+        tables = get_tables()
+        key = (road_class, ffs)
+        with self._lock:
+            if tables is not self._tables:
+                self._curves.clear()
+                self._tables = tables
+            curve = self._curves.get(key)
+            if curve is not None:
+                self.hits += 1
+                self._curves.move_to_end(key)
+                return curve
+            self.misses += 1
+
+        row = tables.lookup_capacity(road_class, ffs)
+        curve = VanAerdeCurve(VanAerdeModel(row.base_capacity, row.opt_speed, ffs, row.jam_density))
+
+        with self._lock:
+            if tables is self._tables:
+                self._curves[key] = curve
+                while len(self._curves) > self.maxsize:
+                    self._curves.popitem(last=False)
+        return curve
+
+    def prewarm(self):
+        """
+        Calculates curves for all rows of capacity table (e.g. at application startup).
+        """
+        for road_class, ffs in get_tables().capacity_keys():
+            self.get(road_class, ffs)
+
+    def clear(self):
+        with self._lock:
+            self._curves.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._curves),
+                    'maxsize': self.maxsize,
+                    'nbytes': sum(curve.nbytes for curve in self._curves.values())}
+
+
+curve_cache = CurveCache()